@@ -17,48 +17,221 @@
 
 import cairo
 import math
+import time
 
 from gi.repository import GLib
 from gi.repository import GObject
-from gi.repository import Gdk
 from gi.repository import GdkPixbuf
 from gi.repository import Gtk
 
+import animation
+import decoder
+import exif
+import memorybudget
+import pyramid
+import qualityscheduler
+import regiondecoder
+import scaledcache
+
 ZOOM_STEP = 0.05
 ZOOM_MAX = 10
 ZOOM_MIN = 0.05
 
+# Time constant of the zoom animation, in seconds.
+ZOOM_ANIMATION_TIME = 0.08
 
-def _surface_from_file(file_location, ctx):
-    pixbuf = GdkPixbuf.Pixbuf.new_from_file(file_location)
-    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
-                                 pixbuf.get_width(), pixbuf.get_height())
+# Time constant of the slow down of kinetic panning, in seconds.
+KINETIC_FRICTION_TIME = 0.35
 
-    ctx_surface = cairo.Context(surface)
-    Gdk.cairo_set_source_pixbuf(ctx_surface, pixbuf, 0, 0)
-    ctx_surface.paint()
-    return surface
+# Kinetic panning stops below this speed, in pixels per second.
+KINETIC_MIN_SPEED = 30
+
+# Weight of the last frame in the speed of the finger.
+DRAG_SPEED_WEIGHT = 0.5
+
+# Formats that may hold an animation instead of a single image.
+ANIMATION_FORMATS = ('gif',)
+
+# Vector formats, rendered at the zoom of the view when possible.
+VECTOR_FORMATS = ('svg',)
 
+# Extra area decoded around the visible one for images too big to be
+# decoded in full, as a fraction of the view size on each side.
+REGION_MARGIN = 0.25
 
-def _rotate_surface(surface, direction):
-    ctx = cairo.Context(surface)
-    new_surface = ctx.get_target().create_similar(
-        cairo.CONTENT_COLOR_ALPHA, surface.get_height(),
-        surface.get_width())
 
-    ctx_surface = cairo.Context(new_surface)
+def _get_image_info(file_location):
+    # Read the format and the dimensions of the image from the file
+    # header, without decoding it.
+    image_format, width, height = \
+        GdkPixbuf.Pixbuf.get_file_info(file_location)
+    if image_format is None:
+        return (None, None)
+    return (image_format.get_name(), (width, height))
 
-    if direction == 1:
-        ctx_surface.translate(surface.get_height(), 0)
+
+def _orientation_matrix(rotation, mirror, width, height):
+    # Transformation from the image of the given size, as it is
+    # decoded, to the image mirrored horizontally if requested and
+    # then rotated by the given number of clockwise quarter turns.
+    # The matrices are built by hand so they stay exactly axis
+    # aligned, which keeps painting on the fast paths of cairo.
+    if rotation == 1:
+        matrix = cairo.Matrix(0, 1, -1, 0, height, 0)
+    elif rotation == 2:
+        matrix = cairo.Matrix(-1, 0, 0, -1, width, height)
+    elif rotation == 3:
+        matrix = cairo.Matrix(0, -1, 1, 0, 0, width)
     else:
-        ctx_surface.translate(0, surface.get_width())
+        matrix = cairo.Matrix()
+
+    if mirror:
+        matrix = cairo.Matrix(-1, 0, 0, 1, width, 0).multiply(matrix)
+    return matrix
+
+
+def _get_fit_scale(image_size, rotation, view_size, zoom=None):
+    # Scale to decode the image at, to fit the view or for the zoom
+    # if set.  Images are never decoded bigger than their size.
+    width, height = image_size
+    if rotation % 2 == 1:
+        width, height = height, width
+    fit_scale = min(view_size[0] * 1.0 / width, view_size[1] * 1.0 / height)
+    return min(max(fit_scale, zoom or 0), 1.0)
+
+
+def _get_budget_scale(image_size):
+    # Scale of the biggest image that fits in the memory budget.
+    budget = memorybudget.get_memory_budget()
+    max_pixels = budget.get_max_image_size() / 4.0
+    return math.sqrt(max_pixels / (image_size[0] * image_size[1]))
+
+
+def _get_decode_size(image_size, scale):
+    if scale == 1:
+        return (None, None)
+    return (max(1, int(math.ceil(image_size[0] * scale))),
+            max(1, int(math.ceil(image_size[1] * scale))))
+
+
+class PreparedImage(object):
+    """
+    An image decoded ahead of time, which the view shows at once.
+    """
+
+    def __init__(self, image_format, image_size, orientation, surface,
+                 scale):
+        self.image_format = image_format
+        self.image_size = image_size
+        self.orientation = orientation
+        self.surface = surface
+        self.scale = scale
+
+
+def decode_cached(job, file_location, width, height, image_size,
+                  cache=None, cache_key=None):
+    # Load the image from the rendition cache if a big enough
+    # rendition is there, else decode it and store it for next time.
+    if cache is not None and image_size is not None:
+        surface = cache.load(cache_key, width or image_size[0],
+                             height or image_size[1])
+        if surface is not None:
+            return surface
+
+    surface = decoder.decode_surface(job, file_location, width, height)
+    if surface is not None and cache is not None:
+        cache.store(cache_key, surface)
+    return surface
 
-    ctx_surface.rotate(math.pi / 2 * direction)
 
-    ctx_surface.set_source_surface(surface, 0, 0)
-    ctx_surface.paint()
+def prepare_image(job, file_location, view_size, cache=None,
+                  cache_key=None):
+    # Decode an image in a decode job the way the view would for a
+    # view of the given size.  Animations and vector images are left
+    # to the view.
+    image_format, image_size = _get_image_info(file_location)
+    if image_format is None or image_format in ANIMATION_FORMATS or \
+            image_format in VECTOR_FORMATS:
+        return None
+
+    try:
+        orientation = exif.read_exif(file_location)[0]
+    except (IOError, OSError):
+        orientation = 1
+
+    rotation = exif.TRANSFORMS[orientation][1]
+    scale = min(_get_fit_scale(image_size, rotation, view_size),
+                _get_budget_scale(image_size))
+    width, height = _get_decode_size(image_size, scale)
+    surface = decode_cached(job, file_location, width, height, image_size,
+                            cache, cache_key)
+    if surface is None:
+        return None
+    return PreparedImage(image_format, image_size, orientation, surface,
+                         scale)
+
+
+def prepare_thumbnail(job, file_location, size, cache=None, cache_key=None):
+    # Decode an image in a decode job to fit a square of the given
+    # size, oriented.
+    return prepare_fitted(job, file_location, (size, size), cache, cache_key)
+
+
+def prepare_fitted(job, file_location, box_size, cache=None,
+                   cache_key=None):
+    # Decode an image in a decode job to fit a box of the given size,
+    # oriented, ready to be painted.  Animations give their first
+    # frame.
+    image_format, image_size = _get_image_info(file_location)
+    if image_format is None:
+        return None
+
+    try:
+        orientation = exif.read_exif(file_location)[0]
+    except (IOError, OSError):
+        orientation = 1
+    mirror, rotation = exif.TRANSFORMS[orientation]
+
+    scale = _get_fit_scale(image_size, rotation, box_size)
+    width, height = _get_decode_size(image_size, scale)
+    width = width or image_size[0]
+    height = height or image_size[1]
+    if image_format in VECTOR_FORMATS and decoder.Rsvg is not None:
+        surface = decoder.decode_svg(job, file_location, width, height)
+    else:
+        surface = decode_cached(job, file_location, width, height,
+                                image_size, cache, cache_key)
+    if surface is None or job.is_cancelled():
+        return None
+
+    # The rendition cache may give a bigger image, it is scaled down
+    # with the orientation applied.
+    if rotation % 2 == 1:
+        thumbnail = cairo.ImageSurface(cairo.FORMAT_ARGB32, height, width)
+    else:
+        thumbnail = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    ctx = cairo.Context(thumbnail)
+    ctx.transform(_orientation_matrix(rotation, mirror, width, height))
+    ctx.scale(width * 1.0 / surface.get_width(),
+              height * 1.0 / surface.get_height())
+
+    # Gray images are alpha only surfaces, white shows through them
+    # over black.
+    if surface.get_format() == cairo.FORMAT_A8:
+        ctx.paint()
+        ctx.set_source_rgb(1, 1, 1)
+        ctx.mask_surface(surface, 0, 0)
+    else:
+        ctx.set_source_surface(surface, 0, 0)
+        ctx.get_source().set_filter(cairo.FILTER_GOOD)
+        ctx.paint()
+    return thumbnail
+
 
-    return new_surface
+def _rect_contains(rect, other):
+    return other[0] >= rect[0] and other[1] >= rect[1] and \
+        other[0] + other[2] <= rect[0] + rect[2] and \
+        other[1] + other[3] <= rect[1] + rect[3]
 
 
 class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
@@ -81,7 +254,39 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
         Gtk.DrawingArea.__init__(self)
 
         self._file_location = None
+        self._rendition_cache = None
+        self._cache_key = None
         self._surface = None
+        self._surface_scale = 1
+        self._surface_partial = False
+        self._image_format = None
+        self._image_size = None
+        self._rotation = 0
+        self._mirror = False
+        self._animation = None
+        self._svg_handle = None
+        self._svg_job = None
+
+        # Images too big for the memory budget are decoded in full at
+        # a reduced size, and the visible region at the zoom of the
+        # view.
+        self._region_source = None
+        self._region_source_job = None
+        self._region = None
+        self._region_job = None
+        self._region_request = None
+
+        self._pyramid = None
+        self._scaled_cache = scaledcache.ScaledCache(self._render_scaled)
+
+        # Keys of the memory used by this view in the budget.
+        self._budget = memorybudget.get_memory_budget()
+        self._surface_key = ('surface', id(self))
+        self._region_key = ('region', id(self))
+        self._pyramid_key = ('pyramid', id(self))
+        self._scaled_cache_key = ('scaled-cache', id(self))
+        self._decode_job = None
+        self._requested_scale = 0
         self._zoom = None
         self._target_point = None
         self._anchor_point = None
@@ -90,8 +295,17 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
         self._in_zoomtouch = False
         self._zoomtouch_scale = 1
 
-        self._in_scrolling = False
-        self._scrolling_hid = None
+        # Input is applied and animated once per frame, from the tick
+        # callback.
+        self._tick_id = None
+        self._last_frame_time = None
+        self._zoom_target = None
+        self._pending_drag = None
+        self._pending_zoomtouch = None
+        self._drag_velocity = (0, 0)
+        self._in_kinetic = False
+
+        self._quality = qualityscheduler.QualityScheduler(self.queue_draw)
         self._hadj = None
         self._vadj = None
         self._hadj_value_changed_hid = None
@@ -99,12 +313,457 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
 
         self.connect('draw', self.__draw_cb)
 
-    def set_file_location(self, file_location):
+    def set_rendition_cache(self, cache):
+        self._rendition_cache = cache
+
+    def set_file_location(self, file_location, prepared=None,
+                          cache_key=None):
+        # The prepared image, if any, is shown right away.  Images
+        # with a cache key are loaded from the rendition cache when
+        # possible.
         self._surface = None
+        self._surface_scale = 1
+        self._surface_partial = False
+        self._image_format = None
+        self._image_size = None
+        self._rotation = 0
+        self._mirror = False
+        if self._animation is not None:
+            self._animation.stop()
+            self._animation = None
+        self._svg_handle = None
+        if self._svg_job is not None:
+            self._svg_job.cancel()
+            self._svg_job = None
+        for job in (self._region_source_job, self._region_job):
+            if job is not None:
+                job.cancel()
+        self._region_source = None
+        self._region_source_job = None
+        self._region = None
+        self._region_job = None
+        self._region_request = None
+        self._pyramid = None
+        self._scaled_cache.invalidate()
         self._zoom = None
+        self._zoom_target = None
+        self._in_kinetic = False
         self._file_location = file_location
+        self._cache_key = cache_key
+
+        if self._decode_job is not None:
+            self._decode_job.cancel()
+            self._decode_job = None
+        self._requested_scale = 0
+        self._update_budget()
+        self._quality.reset()
+
+        if prepared is not None:
+            self._image_format = prepared.image_format
+            self._image_size = prepared.image_size
+            self._mirror, self._rotation = \
+                exif.TRANSFORMS[prepared.orientation]
+            self._requested_scale = prepared.scale
+            self._set_surface(prepared.surface)
+
+            # The view may be bigger than the one it was prepared for.
+            self._request_surface()
+
         self.queue_draw()
 
+    def is_loading(self):
+        return self._decode_job is not None
+
+    def has_file(self):
+        # A preview alone can't be zoomed or rotated.
+        return self._file_location is not None
+
+    def set_preview(self, surface, orientation=1):
+        # Show a small version of an image, like the journal preview,
+        # scaled to fit the view.  Nothing is decoded until a file
+        # location is set.
+        self.set_file_location(None)
+        if surface is None:
+            return
+
+        alloc = self.get_allocation()
+        self._mirror, self._rotation = exif.TRANSFORMS[orientation]
+        width, height = surface.get_width(), surface.get_height()
+        oriented_width, oriented_height = width, height
+        if self._rotation % 2 == 1:
+            oriented_width, oriented_height = height, width
+        scale = max(1.0, min(alloc.width * 1.0 / oriented_width,
+                             alloc.height * 1.0 / oriented_height))
+        self._image_size = (int(round(width * scale)),
+                            int(round(height * scale)))
+
+        # The preview is all there is to show.
+        self._requested_scale = 1.0
+        self._set_surface(surface)
+
+    def _read_exif(self):
+        # Orient the image as the camera tells and show the embedded
+        # thumbnail, if any, while the image is decoded.
+        try:
+            orientation, thumbnail = exif.read_exif(self._file_location)
+        except (IOError, OSError):
+            return
+
+        self._mirror, self._rotation = exif.TRANSFORMS[orientation]
+
+        if thumbnail is None or self._image_size is None:
+            return
+        try:
+            surface = decoder.decode_bytes(thumbnail)
+        except GLib.Error:
+            return
+
+        # Some cameras add black borders to the thumbnail to fit a
+        # fixed size, those would look squashed over the image.
+        image_aspect = self._image_size[0] * 1.0 / self._image_size[1]
+        thumbnail_aspect = surface.get_width() * 1.0 / surface.get_height()
+        if abs(image_aspect / thumbnail_aspect - 1) > 0.02:
+            return
+
+        self._set_surface(surface)
+
+    def _request_surface(self, full_size=False):
+        # Unless the full size is requested, decode the image just big
+        # enough for the current zoom, or to fit the window if the
+        # zoom is not set yet.  The decoding happens in a background
+        # thread, meanwhile the view shows the previous surface, if
+        # any.
+        if self._image_format in ANIMATION_FORMATS:
+            self._request_animation()
+            return
+
+        scale = 1.0
+        if self._is_vector():
+            scale = self._get_vector_scale()
+        elif self._image_size is not None and not full_size:
+            alloc = self.get_allocation()
+            scale = _get_fit_scale(self._image_size, self._rotation,
+                                   (alloc.width, alloc.height), self._zoom)
+
+        # Images that would not fit in the memory budget are decoded
+        # at a reduced size.  Zooming in decodes only the visible
+        # region, if the file allows it.
+        open_region_source = False
+        if self._image_size is not None:
+            budget_scale = _get_budget_scale(self._image_size)
+            open_region_source = budget_scale < 1 and \
+                not self._is_vector() and \
+                self._region_source_job is None and \
+                self._region_source is None
+            scale = min(scale, budget_scale)
+
+        if scale > self._requested_scale:
+            self._submit_decode(scale)
+
+        # Queued after the decoding of the whole image, so it shows
+        # first.
+        if open_region_source:
+            self._open_region_source()
+
+    def _submit_decode(self, scale):
+        self._requested_scale = scale
+
+        width, height = _get_decode_size(self._image_size, scale)
+
+        if self._decode_job is not None:
+            self._decode_job.cancel()
+
+        if self._is_vector():
+            self._decode_job = decoder.get_decode_queue().submit(
+                decoder.PRIORITY_VISIBLE, decoder.decode_svg,
+                self.__surface_decoded_cb, self._file_location,
+                width or self._image_size[0],
+                height or self._image_size[1])
+            return
+
+        # The partially decoded image is only shown while there is no
+        # complete one, the decoder doesn't copy it for nothing.
+        progress_callback = None
+        if self._surface is None or self._surface_partial:
+            progress_callback = self.__surface_progress_cb
+        self._decode_job = decoder.get_decode_queue().submit(
+            decoder.PRIORITY_VISIBLE, decode_cached,
+            self.__surface_decoded_cb, self._file_location, width, height,
+            self._image_size, self._rendition_cache, self._cache_key,
+            progress_callback=progress_callback)
+
+    def _open_region_source(self):
+        self._region_source_job = decoder.get_decode_queue().submit(
+            decoder.PRIORITY_VISIBLE, regiondecoder.open_region_source,
+            self.__region_source_opened_cb, self._file_location)
+
+    def __region_source_opened_cb(self, source):
+        # Keep the job around so the source is only opened once,
+        # even if regions can't be decoded from this file.
+        self._region_source = source
+        if source is not None:
+            self.queue_draw()
+
+    def _get_image_rect(self, zoom, origin, margin):
+        # Visible area of the view, with a margin around it, in the
+        # coordinates of the full size image as it is decoded.
+        alloc = self.get_allocation()
+        margin_x = alloc.width * margin
+        margin_y = alloc.height * margin
+        x1 = (-origin[0] - margin_x) / zoom
+        y1 = (-origin[1] - margin_y) / zoom
+        x2 = (alloc.width - origin[0] + margin_x) / zoom
+        y2 = (alloc.height - origin[1] + margin_y) / zoom
+
+        matrix = _orientation_matrix(self._rotation, self._mirror,
+                                     *self._image_size)
+        matrix.invert()
+        corners = [matrix.transform_point(x, y)
+                   for x in (x1, x2) for y in (y1, y2)]
+
+        width, height = self._image_size
+        left = max(0, int(math.floor(min(x for x, y in corners))))
+        top = max(0, int(math.floor(min(y for x, y in corners))))
+        right = min(width, int(math.ceil(max(x for x, y in corners))))
+        bottom = min(height, int(math.ceil(max(y for x, y in corners))))
+        if right <= left or bottom <= top:
+            return None
+        return (left, top, right - left, bottom - top)
+
+    def _request_region(self, zoom, origin):
+        visible = self._get_image_rect(zoom, origin, 0)
+        if visible is None:
+            return
+        scale = min(zoom, 1.0)
+
+        # Nothing to do if the region decoded or being decoded
+        # already covers the view.
+        for region in (self._region_request, self._get_region_info()):
+            if region is not None and region[1] >= scale and \
+                    _rect_contains(region[0], visible):
+                return
+
+        # Decode the margin too if it fits in the memory ceiling.  The
+        # source decodes whole strips, tiles or restart intervals,
+        # which can be much bigger than the rect.
+        source = self._region_source
+        max_pixels = self._budget.get_max_image_size() / 4.0
+        rect = self._get_image_rect(zoom, origin, REGION_MARGIN)
+        if source.get_decode_pixels(rect, scale) > max_pixels:
+            rect = visible
+            if source.get_decode_pixels(rect, scale) > max_pixels:
+                return
+
+        if self._region_job is not None:
+            self._region_job.cancel()
+        self._region_request = (rect, scale)
+        self._region_job = decoder.get_decode_queue().submit(
+            decoder.PRIORITY_VISIBLE, regiondecoder.decode_region,
+            self.__region_decoded_cb, self._region_source, rect, scale)
+
+    def __region_decoded_cb(self, region):
+        self._region_job = None
+        self._region_request = None
+        if region is None:
+            return
+
+        self._region = region
+        self._scaled_cache.invalidate()
+        self._update_budget()
+        self.queue_draw()
+
+    def _get_region_info(self):
+        # The rect of the decoded region and its scale.
+        if self._region is None:
+            return None
+        rect, surface = self._region
+        return (rect, surface.get_width() * 1.0 / rect[2])
+
+    def __region_evicted_cb(self, key):
+        self._region = None
+        self._scaled_cache.invalidate()
+
+    def _is_vector(self):
+        return self._image_format in VECTOR_FORMATS and \
+            self._image_size is not None and decoder.Rsvg is not None
+
+    def _get_vector_scale(self):
+        # Vector images are rasterized for the fit to window zoom or
+        # the current zoom, rounded up to a power of two so zooming
+        # only renders them again once in a while.  The raster is
+        # only shown while the view moves, once settled the visible
+        # area is rendered straight from the vector image.
+        alloc = self.get_allocation()
+        image_width, image_height = self._get_oriented_size()
+        fit_scale = min(alloc.width * 1.0 / image_width,
+                        alloc.height * 1.0 / image_height)
+        scale = max(fit_scale, self._zoom or 0)
+        return 2 ** math.ceil(math.log(scale, 2))
+
+    def _load_svg_handle(self):
+        self._svg_job = decoder.get_decode_queue().submit(
+            decoder.PRIORITY_VISIBLE, decoder.load_svg,
+            self.__svg_loaded_cb, self._file_location)
+
+    def __svg_loaded_cb(self, handle):
+        self._svg_job = None
+        if handle is None:
+            return
+        self._svg_handle = handle
+        self._scaled_cache.invalidate()
+        self.queue_draw()
+
+    def _request_animation(self):
+        # Animations are always decoded at full size, they are small.
+        if self._requested_scale >= 1:
+            return
+        self._requested_scale = 1.0
+
+        self._decode_job = decoder.get_decode_queue().submit(
+            decoder.PRIORITY_VISIBLE, decoder.decode_animation,
+            self.__animation_decoded_cb, self._file_location)
+
+    def __animation_decoded_cb(self, pixbuf_animation):
+        self._decode_job = None
+        if pixbuf_animation is None:
+            return
+
+        if pixbuf_animation.is_static_image():
+            self._set_surface(decoder.surface_from_pixbuf(
+                pixbuf_animation.get_static_image()))
+            return
+
+        self._animation = animation.AnimationPlayer(
+            pixbuf_animation, self._budget.get_max_image_size())
+        self._set_surface(self._animation.get_surface())
+        self._start_ticking()
+
+    def __surface_progress_cb(self, surface):
+        # Show the image while it is being decoded, unless there is
+        # already a complete surface at a lower resolution, like the
+        # embedded thumbnail.
+        if self._surface is not None and not self._surface_partial:
+            return
+
+        self._set_surface(surface)
+        self._surface_partial = True
+
+    def __surface_decoded_cb(self, surface):
+        self._decode_job = None
+        if surface is None:
+            return
+
+        self._set_surface(surface)
+        self._surface_partial = False
+
+    def _set_surface(self, surface):
+        if self._image_size is None:
+            self._image_size = (surface.get_width(), surface.get_height())
+
+        self._surface = surface
+        self._surface_scale = surface.get_width() * 1.0 / self._image_size[0]
+        self._pyramid = None
+        self._scaled_cache.invalidate()
+        self._update_budget()
+        self.queue_draw()
+
+    def _update_budget(self):
+        # The surface on screen is accounted but can't be evicted,
+        # the tiles and the cache are rendered again if evicted.
+        if self._animation is not None:
+            self._budget.add(self._surface_key, self._animation.get_size())
+        elif self._surface is None:
+            self._budget.remove(self._surface_key)
+        else:
+            self._budget.add(self._surface_key,
+                             memorybudget.get_surface_size(self._surface))
+
+        if self._region is None:
+            self._budget.remove(self._region_key)
+        else:
+            self._budget.add(self._region_key,
+                             memorybudget.get_surface_size(self._region[1]),
+                             self.__region_evicted_cb)
+
+        if self._pyramid is None:
+            self._budget.remove(self._pyramid_key)
+        else:
+            self._budget.add(self._pyramid_key,
+                             self._pyramid.get_tiles_size(),
+                             self.__pyramid_evicted_cb)
+
+        self._budget.add(self._scaled_cache_key,
+                         self._scaled_cache.get_size(),
+                         self.__scaled_cache_evicted_cb)
+
+    def __pyramid_evicted_cb(self, key):
+        if self._pyramid is not None:
+            self._pyramid.clear()
+
+    def __scaled_cache_evicted_cb(self, key):
+        self._scaled_cache.invalidate()
+
+    def _get_oriented_size(self):
+        # The image size once rotated.  Everything but decoding works
+        # with the rotated image.
+        width, height = self._image_size
+        if self._rotation % 2 == 1:
+            return (height, width)
+        return (width, height)
+
+    def _transform_to_surface(self, ctx):
+        # Change the context from rotated image coordinates to the
+        # coordinates of the decoded surface.
+        ctx.transform(_orientation_matrix(self._rotation, self._mirror,
+                                          *self._image_size))
+        ctx.scale(1.0 / self._surface_scale, 1.0 / self._surface_scale)
+
+    def _render_scaled(self, ctx, zoom, quality):
+        # Called by the scaled cache with the context in scaled image
+        # coordinates.  The cache holds the image already rotated, so
+        # this is the only place other than the pinch to zoom drawing
+        # where rotated pixels are produced.
+        ctx.scale(zoom, zoom)
+
+        # Vector images are rendered at the exact zoom once the view
+        # settles, only inside the clip set by the cache.
+        if self._svg_handle is not None and \
+                quality >= qualityscheduler.QUALITY_GOOD:
+            ctx.transform(_orientation_matrix(self._rotation, self._mirror,
+                                              *self._image_size))
+            dimensions = self._svg_handle.get_dimensions()
+            ctx.scale(self._image_size[0] * 1.0 / dimensions.width,
+                      self._image_size[1] * 1.0 / dimensions.height)
+            self._svg_handle.render_cairo(ctx)
+            return
+
+        self._paint_image(ctx, zoom, qualityscheduler.FILTERS[quality])
+
+    def _paint_image(self, ctx, zoom, filter):
+        # Paint the image with the context in rotated image
+        # coordinates, scaled by the zoom.  Only the tiles of the
+        # pyramid level closest to the zoom that are inside the clip
+        # are painted.
+        ctx.save()
+        self._transform_to_surface(ctx)
+        self._pyramid.draw(ctx, zoom / self._surface_scale, filter)
+        ctx.restore()
+
+        # The region decoded at a higher resolution goes on top.
+        region_info = self._get_region_info()
+        if region_info is None or region_info[1] <= self._surface_scale:
+            return
+        (x, y, width, height), surface = self._region
+        ctx.transform(_orientation_matrix(self._rotation, self._mirror,
+                                          *self._image_size))
+        ctx.translate(x, y)
+        ctx.scale(width * 1.0 / surface.get_width(),
+                  height * 1.0 / surface.get_height())
+        ctx.set_source_surface(surface, 0, 0)
+        ctx.get_source().set_filter(filter)
+        ctx.rectangle(0, 0, surface.get_width(), surface.get_height())
+        ctx.fill()
+
     def do_get_property(self, prop):
         # We don't use the getter but GTK wants it defined as we are
         # implementing Gtk.Scrollable interface.
@@ -130,8 +789,9 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
 
     def _update_adjustments(self):
         alloc = self.get_allocation()
-        scaled_width = self._surface.get_width() * self._zoom
-        scaled_height = self._surface.get_height() * self._zoom
+        image_width, image_height = self._get_oriented_size()
+        scaled_width = image_width * self._zoom
+        scaled_height = image_height * self._zoom
 
         page_size_x = alloc.width * 1.0 / scaled_width
         self._hadj.set_lower(0)
@@ -179,26 +839,15 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
                 self._vadj.connect('value-changed',
                                    self.__vadj_value_changed_cb)
 
-    def _stop_scrolling(self):
-        self._in_scrolling = False
-        self.queue_draw()
-        self._scrolling_hid = None
-        return False
-
-    def _start_scrolling(self):
-        if not self._in_scrolling:
-            self._in_scrolling = True
-
-        # Add or update a timer after which the in_scrolling flag will
-        # be set to False.  This is to perform a faster drawing while
-        # scrolling.
-        if self._scrolling_hid is not None:
-            GLib.source_remove(self._scrolling_hid)
-        self._scrolling_hid = GLib.timeout_add(200, self._stop_scrolling)
+    def _start_input(self):
+        # Every input that moves or zooms the view lowers the render
+        # quality to what fits in a frame, until the view settles.
+        alloc = self.get_allocation()
+        self._quality.start_input(alloc.width * alloc.height)
 
     def __hadj_value_changed_cb(self, adj):
         alloc = self.get_allocation()
-        scaled_width = self._surface.get_width() * self._zoom
+        scaled_width = self._get_oriented_size()[0] * self._zoom
         anchor_scaled_x = self._anchor_point[0] * self._zoom
         scaled_image_left = self._target_point[0] - anchor_scaled_x
 
@@ -210,12 +859,12 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
         self._anchor_point = (self._anchor_point[0] + delta_x,
                               self._anchor_point[1])
 
-        self._start_scrolling()
+        self._start_input()
         self.queue_draw()
 
     def __vadj_value_changed_cb(self, adj):
         alloc = self.get_allocation()
-        scaled_height = self._surface.get_height() * self._zoom
+        scaled_height = self._get_oriented_size()[1] * self._zoom
         anchor_scaled_y = self._anchor_point[1] * self._zoom
         scaled_image_top = self._target_point[1] - anchor_scaled_y
 
@@ -227,7 +876,7 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
         self._anchor_point = (self._anchor_point[0],
                               self._anchor_point[1] + delta_y)
 
-        self._start_scrolling()
+        self._start_input()
         self.queue_draw()
 
     def _center_target_point(self):
@@ -235,8 +884,8 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
         self._target_point = (alloc.width / 2, alloc.height / 2)
 
     def _center_anchor_point(self):
-        self._anchor_point = (self._surface.get_width() / 2,
-                              self._surface.get_height() / 2)
+        image_width, image_height = self._get_oriented_size()
+        self._anchor_point = (image_width / 2, image_height / 2)
 
     def _center_if_small(self):
         # If at the current size the image surface is smaller than the
@@ -244,8 +893,9 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
 
         alloc = self.get_allocation()
 
-        scaled_width = self._surface.get_width() * self._zoom
-        scaled_height = self._surface.get_height() * self._zoom
+        image_width, image_height = self._get_oriented_size()
+        scaled_width = image_width * self._zoom
+        scaled_height = image_height * self._zoom
 
         if alloc.width >= scaled_width and alloc.height >= scaled_height:
             self._center_target_point()
@@ -256,33 +906,79 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
         if zoom < ZOOM_MIN or zoom > ZOOM_MAX:
             return
         self._zoom = zoom
+        self._zoom_target = None
         self.queue_draw()
 
     def get_zoom(self):
         return self._zoom
 
+    def _get_zoom_target(self):
+        if self._zoom_target is None:
+            return self._zoom
+        return self._zoom_target
+
     def can_zoom_in(self):
-        return self._zoom + ZOOM_STEP < ZOOM_MAX
-        self._update_adjustments()
+        return self._get_zoom_target() + ZOOM_STEP < ZOOM_MAX
 
     def can_zoom_out(self):
-        return self._zoom - ZOOM_STEP > ZOOM_MIN
-        self._update_adjustments()
+        return self._get_zoom_target() - ZOOM_STEP > ZOOM_MIN
 
     def zoom_in(self):
         if not self.can_zoom_in():
             return
-        self._zoom += ZOOM_STEP
-        self._update_adjustments()
-        self.queue_draw()
+        # Repeated clicks add up to the target of the animation.
+        self._zoom_target = self._get_zoom_target() + ZOOM_STEP
+        self._start_ticking()
 
     def zoom_out(self):
         if not self.can_zoom_out():
             return
-        self._zoom -= ZOOM_MIN
+        self._zoom_target = self._get_zoom_target() - ZOOM_STEP
+        self._start_ticking()
+
+    def _start_ticking(self):
+        if self._tick_id is None:
+            self._last_frame_time = None
+            self._tick_id = self.add_tick_callback(self.__tick_cb)
+
+    def __tick_cb(self, widget, frame_clock):
+        frame_time = frame_clock.get_frame_time() / 1000000.0
+        if self._last_frame_time is None:
+            elapsed = 0
+        else:
+            elapsed = frame_time - self._last_frame_time
+        self._last_frame_time = frame_time
+
+        if self._pending_zoomtouch is not None:
+            self._apply_zoomtouch()
+        if self._in_dragtouch:
+            self._apply_dragtouch(elapsed)
+        if self._in_kinetic:
+            self._apply_kinetic(elapsed)
+        if self._zoom_target is not None:
+            self._apply_zoom_animation(elapsed)
+        if self._animation is not None and self._animation.tick(frame_time):
+            self._set_surface(self._animation.get_surface())
+
+        if self._in_dragtouch or self._in_kinetic or \
+                self._zoom_target is not None:
+            return True
+        if self._animation is not None and self._animation.is_playing():
+            return True
+
+        self._tick_id = None
+        return False
+
+    def _apply_zoom_animation(self, elapsed):
+        fraction = 1 - math.exp(-elapsed / ZOOM_ANIMATION_TIME)
+        self._zoom += (self._zoom_target - self._zoom) * fraction
+        if abs(self._zoom_target - self._zoom) < 0.001:
+            self._zoom = self._zoom_target
+            self._zoom_target = None
 
         self._center_if_small()
         self._update_adjustments()
+        self._start_input()
         self.queue_draw()
 
     def zoom_to_fit(self):
@@ -290,15 +986,15 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
         # If the image can fit in, we show it in 1:1,
         # in any other case we show it in a fit to screen way
 
+        self._zoom_target = None
         alloc = self.get_allocation()
 
-        surface_width = self._surface.get_width()
-        surface_height = self._surface.get_height()
+        image_width, image_height = self._get_oriented_size()
 
-        if alloc.width < surface_width or alloc.height < surface_height:
+        if alloc.width < image_width or alloc.height < image_height:
             # Image is larger than allocated size
-            self._zoom = min(alloc.width * 1.0 / surface_width,
-                             alloc.height * 1.0 / surface_height)
+            self._zoom = min(alloc.width * 1.0 / image_width,
+                             alloc.height * 1.0 / image_height)
         else:
             self._zoom = 1.0
 
@@ -309,6 +1005,7 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
 
     def zoom_original(self):
         self._zoom = 1
+        self._zoom_target = None
         self._center_if_small()
         self._update_adjustments()
         self.queue_draw()
@@ -333,6 +1030,12 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
     def start_dragtouch(self, coords):
         self._in_dragtouch = True
 
+        # Touching the screen stops kinetic panning.
+        self._in_kinetic = False
+        self._pending_drag = None
+        self._drag_velocity = (0, 0)
+        self._start_ticking()
+
         prev_target_point = self._target_point
 
         # Set target point to the relative coordinates of this view.
@@ -351,21 +1054,102 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
             self.start_dragtouch(coords)
             return
 
-        self._target_point = (coords[1], coords[2])
-        self._update_adjustments()
-        self.queue_draw()
+        # Only the last position is applied on the next frame.
+        self._pending_drag = (coords[1], coords[2])
+
+    def _apply_dragtouch(self, elapsed):
+        velocity_x, velocity_y = self._drag_velocity
+        if self._pending_drag is not None:
+            delta_x = self._pending_drag[0] - self._target_point[0]
+            delta_y = self._pending_drag[1] - self._target_point[1]
+            self._target_point = self._pending_drag
+            self._pending_drag = None
+        else:
+            delta_x = delta_y = 0
+
+        # Keep the speed of the finger for kinetic panning.  When the
+        # finger stays still the speed goes down.
+        if elapsed > 0:
+            velocity_x = delta_x / elapsed * DRAG_SPEED_WEIGHT + \
+                velocity_x * (1 - DRAG_SPEED_WEIGHT)
+            velocity_y = delta_y / elapsed * DRAG_SPEED_WEIGHT + \
+                velocity_y * (1 - DRAG_SPEED_WEIGHT)
+            self._drag_velocity = (velocity_x, velocity_y)
+
+        if delta_x != 0 or delta_y != 0:
+            self._update_adjustments()
+            self._start_input()
+            self.queue_draw()
 
     def finish_dragtouch(self, coords):
+        if self._pending_drag is not None:
+            self._target_point = self._pending_drag
+            self._pending_drag = None
         self._in_dragtouch = False
+
+        if math.hypot(*self._drag_velocity) > KINETIC_MIN_SPEED:
+            self._in_kinetic = True
+            self._start_ticking()
+            return
+
         self._center_if_small()
         self._update_adjustments()
 
+    def _apply_kinetic(self, elapsed):
+        decay = math.exp(-elapsed / KINETIC_FRICTION_TIME)
+        velocity_x = self._drag_velocity[0] * decay
+        velocity_y = self._drag_velocity[1] * decay
+
+        target_x = self._target_point[0] + velocity_x * elapsed
+        target_y = self._target_point[1] + velocity_y * elapsed
+
+        # Stop at the borders of the image, and don't move images
+        # smaller than the view.
+        alloc = self.get_allocation()
+        image_width, image_height = self._get_oriented_size()
+        anchor_scaled = (self._anchor_point[0] * self._zoom,
+                         self._anchor_point[1] * self._zoom)
+        scaled_width = image_width * self._zoom
+        scaled_height = image_height * self._zoom
+
+        min_x = alloc.width - scaled_width + anchor_scaled[0]
+        max_x = anchor_scaled[0]
+        if scaled_width <= alloc.width:
+            target_x = self._target_point[0]
+            velocity_x = 0
+        elif target_x < min_x or target_x > max_x:
+            target_x = min(max(target_x, min_x), max_x)
+            velocity_x = 0
+
+        min_y = alloc.height - scaled_height + anchor_scaled[1]
+        max_y = anchor_scaled[1]
+        if scaled_height <= alloc.height:
+            target_y = self._target_point[1]
+            velocity_y = 0
+        elif target_y < min_y or target_y > max_y:
+            target_y = min(max(target_y, min_y), max_y)
+            velocity_y = 0
+
+        self._target_point = (target_x, target_y)
+        self._drag_velocity = (velocity_x, velocity_y)
+
+        if math.hypot(velocity_x, velocity_y) < KINETIC_MIN_SPEED:
+            self._in_kinetic = False
+            self._center_if_small()
+
+        self._update_adjustments()
+        self._start_input()
+        self.queue_draw()
+
     def start_zoomtouch(self, center):
         self._in_zoomtouch = True
         self._zoomtouch_scale = 1
+        self._zoom_target = None
 
         # Zoom touch replaces drag touch.
         self._in_dragtouch = False
+        self._in_kinetic = False
+        self._pending_drag = None
 
         prev_target_point = self._target_point
 
@@ -377,15 +1161,25 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
         self.queue_draw()
 
     def update_zoomtouch(self, center, scale):
+        # Only the last update is applied on the next frame.
+        self._pending_zoomtouch = (center, scale)
+        self._start_ticking()
+
+    def _apply_zoomtouch(self):
+        center, scale = self._pending_zoomtouch
+        self._pending_zoomtouch = None
         self._zoomtouch_scale = scale
 
         # Set target point to the relative coordinates of this view.
         alloc = self.get_allocation()
         self._target_point = (center[1] - alloc.x, center[2] - alloc.y)
 
+        self._start_input()
         self.queue_draw()
 
     def finish_zoomtouch(self):
+        if self._pending_zoomtouch is not None:
+            self._apply_zoomtouch()
         self._in_zoomtouch = False
 
         # Apply zoom
@@ -403,24 +1197,34 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
         self.queue_draw()
 
     def rotate_anticlockwise(self):
-        self._surface = _rotate_surface(self._surface, -1)
+        if self._image_size is None:
+            return
+
+        # The rotation is only applied when drawing, the decoded
+        # surface is never rotated.
+        self._rotation = (self._rotation - 1) % 4
 
         # Recalculate the anchor point to make it relative to the new
         # top left corner.
         self._anchor_point = (
             self._anchor_point[1],
-            self._surface.get_height() - self._anchor_point[0])
+            self._get_oriented_size()[1] - self._anchor_point[0])
 
         self._update_adjustments()
         self.queue_draw()
 
     def rotate_clockwise(self):
-        self._surface = _rotate_surface(self._surface, 1)
+        if self._image_size is None:
+            return
+
+        # The rotation is only applied when drawing, the decoded
+        # surface is never rotated.
+        self._rotation = (self._rotation + 1) % 4
 
         # Recalculate the anchor point to make it relative to the new
         # top left corner.
         self._anchor_point = (
-            self._surface.get_width() - self._anchor_point[1],
+            self._get_oriented_size()[0] - self._anchor_point[1],
             self._anchor_point[0])
 
         self._update_adjustments()
@@ -428,13 +1232,23 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
 
     def __draw_cb(self, widget, ctx):
 
-        # If the image surface is not set, it reads it from the file
-        # location.  If the file location is not set yet, it just
-        # returns.
-        if self._surface is None:
+        # If the image size is not set, it reads it from the file
+        # location and starts decoding the image.  If the file
+        # location is not set yet, it just returns.
+        if self._image_size is None:
             if self._file_location is None:
                 return
-            self._surface = _surface_from_file(self._file_location, ctx)
+            self._image_format, self._image_size = \
+                _get_image_info(self._file_location)
+            self._read_exif()
+            self._request_surface()
+            if self._is_vector():
+                self._load_svg_handle()
+
+            # The size is only known after decoding if the header
+            # could not be read.
+            if self._image_size is None:
+                return
 
         if self._zoom is None:
             self.zoom_to_fit()
@@ -450,17 +1264,74 @@ class ImageViewer(Gtk.DrawingArea, Gtk.Scrollable):
             self._center_anchor_point()
             self._update_adjustments()
 
-        ctx.translate(*self._target_point)
         zoom_absolute = self._zoom * self._zoomtouch_scale
-        ctx.scale(zoom_absolute, zoom_absolute)
 
-        ctx.translate(self._anchor_point[0] * -1, self._anchor_point[1] * -1)
+        # Decode the image at full size once the zoom needs more
+        # pixels than the ones decoded for the window size.  This is
+        # delayed while pinching to keep the gesture responsive.
+        # Vector images have no full size, they are rasterized again
+        # for the new zoom.
+        if zoom_absolute > self._requested_scale and \
+                not self._in_zoomtouch:
+            if self._is_vector():
+                self._request_surface()
+            elif self._requested_scale < 1:
+                self._request_surface(full_size=True)
+
+        # Position of the top left corner of the image in the view.
+        anchor_scaled = (self._anchor_point[0] * zoom_absolute,
+                         self._anchor_point[1] * zoom_absolute)
+        origin = (self._target_point[0] - anchor_scaled[0],
+                  self._target_point[1] - anchor_scaled[1])
+
+        # Images too big to be decoded in full get the visible region
+        # decoded at the resolution the zoom needs.
+        if self._region_source is not None and not self._in_zoomtouch \
+                and self._zoom_target is None \
+                and zoom_absolute > self._surface_scale:
+            self._request_region(zoom_absolute, origin)
+
+        # Until the first decode finishes, show a placeholder with the
+        # size of the image.
+        image_width, image_height = self._get_oriented_size()
+        if self._surface is None:
+            ctx.rectangle(origin[0], origin[1],
+                          image_width * zoom_absolute,
+                          image_height * zoom_absolute)
+            ctx.set_source_rgba(0, 0, 0, 0.1)
+            ctx.fill()
+            return
 
-        ctx.set_source_surface(self._surface, 0, 0)
+        if self._pyramid is None:
+            self._pyramid = pyramid.TiledPyramid(self._surface)
 
-        # Perform faster draw if the view is zooming or scrolling via
-        # mouse or touch.
-        if self._in_zoomtouch or self._in_dragtouch or self._in_scrolling:
-            ctx.get_source().set_filter(cairo.FILTER_NEAREST)
+        # The quality depends on how long frames take to draw.
+        quality = self._quality.get_quality()
+        start_time = time.time()
+        self._draw_image(ctx, zoom_absolute, origin, quality)
+        alloc = self.get_allocation()
+        self._quality.frame_drawn(quality, time.time() - start_time,
+                                  alloc.width * alloc.height)
+        self._update_budget()
+
+    def _draw_image(self, ctx, zoom_absolute, origin, quality):
+        # While the zoom does not change, copy the image from the
+        # rendering cached at this zoom instead of scaling it again.
+        # Pinch to zoom and the zoom animation change the zoom on
+        # every frame, so the cache would only get in the way.
+        if not self._in_zoomtouch and self._zoom_target is None:
+            alloc = self.get_allocation()
+            self._scaled_cache.draw(ctx, (zoom_absolute, self._rotation),
+                                    zoom_absolute, origin,
+                                    (alloc.width, alloc.height),
+                                    self._get_oriented_size(), quality)
+            return
 
-        ctx.paint()
+        ctx.translate(*self._target_point)
+        ctx.scale(zoom_absolute, zoom_absolute)
+
+        ctx.translate(self._anchor_point[0] * -1, self._anchor_point[1] * -1)
+
+        # The surface may be rotated and smaller than the image.
+        self._paint_image(ctx, zoom_absolute,
+                          qualityscheduler.FILTERS[quality])
@@ -31,7 +31,6 @@ from gi.repository import Gtk
 
 from sugar3.graphics.alert import NotifyAlert
 
-from sugar3 import mime
 from sugar3.graphics.toolbutton import ToolButton
 from sugar3.graphics.toolbarbox import ToolbarBox
 from sugar3.graphics.icon import Icon
@@ -44,7 +43,19 @@ from sugar3.datastore import datastore
 from gi.repository import SugarGestures
 
 import collabwrapper
+import decoder
+import imagelist
 import ImageView
+import prefetcher
+import renditioncache
+import slideshow
+import tempfiles
+import thumbnailgrid
+
+# When browsing faster than images can be decoded, like when an arrow
+# key is held, the image is only loaded once there was no browsing
+# for this long, in milliseconds.
+BROWSE_DELAY = 200
 
 
 class ProgressAlert(Alert):
@@ -84,6 +95,8 @@ class ImageViewerActivity(activity.Activity):
 
         # Status of temp file used for write_file:
         self._tempfile = None
+        self._tempfiles = tempfiles.TempFileManager(
+            os.path.join(self.get_activity_root(), 'instance'))
         self._close_requested = False
 
         self._zoom_out_button = None
@@ -98,12 +111,34 @@ class ImageViewerActivity(activity.Activity):
         self.max_participants = 1
 
         # Don't use the default kinetic scrolling, let the view do the
-        # drag-by-touch and pinch-to-zoom logic.
+        # drag-by-touch, kinetic panning and pinch-to-zoom logic.
         self.scrolled_window.set_kinetic_scrolling(False)
 
-        self.view = ImageView.ImageViewer()
+        # Decoded images are kept on disk across sessions.
+        self._rendition_cache = renditioncache.RenditionCache(
+            os.path.join(self.get_activity_root(), 'data', 'renditions'))
 
-        self._image_list = []
+        self.view = ImageView.ImageViewer()
+        self.view.set_rendition_cache(self._rendition_cache)
+        self._prefetcher = prefetcher.Prefetcher(self._rendition_cache)
+        self._load_hid = None
+
+        # The thumbnails of the journal images, shown instead of the
+        # view to pick an image.
+        self._grid = thumbnailgrid.ThumbnailGrid(self._rendition_cache)
+        self._grid.image_activated.connect(self.__grid_image_activated_cb)
+        self._grid_window = Gtk.ScrolledWindow()
+        self._grid_window.set_policy(Gtk.PolicyType.NEVER,
+                                     Gtk.PolicyType.AUTOMATIC)
+        self._grid_window.add(self._grid)
+        self._grid.show()
+
+        self._slideshow = None
+
+        self.image_list = None
+        self.image_count = None
+        self.current_image_index = 0
+        self._waiting_delta = None
         # Connect to the touch signal for performing drag-by-touch.
         self.view.add_events(Gdk.EventMask.TOUCH_MASK)
         self._touch_hid = self.view.connect('touch-event',
@@ -189,6 +224,9 @@ class ImageViewerActivity(activity.Activity):
 
     def __key_press_cb(self, widget, event):
         key_name = Gdk.keyval_name(event.keyval)
+        if (self._is_grid_shown() or self._slideshow is not None) and \
+                key_name in ("Left", "Right"):
+            return False
         if key_name == "Left":
             self._change_image(-1)
         elif key_name == "Right":
@@ -199,16 +237,54 @@ class ImageViewerActivity(activity.Activity):
         return True
 
     def _get_image_list(self):
-        value = mime.GENERIC_TYPE_IMAGE
-        mime_types = mime.get_generic_type(value).mime_types
-        (self.image_list, self.image_count) = datastore.find({'mime_type':
-                                                             mime_types})
+        # The first image shows as soon as the first page of the
+        # journal query arrives, the other pages are queried while
+        # browsing.
+        self.image_list = imagelist.ImageList(self.__image_page_loaded_cb,
+                                              self.__images_changed_cb)
+        self.image_list.load_page(0)
+        return False
+
+    def __image_page_loaded_cb(self, number):
+        first_reply = self.image_count is None
+        self.image_count = len(self.image_list)
+        self._grid.refresh()
+        if self._slideshow is not None:
+            self._slideshow.refresh()
+        if first_reply:
+            self._show_image_list()
+        elif self._waiting_delta is not None:
+            # Browsing reached an image whose page was not loaded.
+            jobject = self.image_list[self.current_image_index]
+            if jobject is not None:
+                delta = self._waiting_delta
+                self._waiting_delta = None
+                self._object_id = jobject.object_id
+                self._load_image(jobject, delta)
+
+    def __images_changed_cb(self):
+        # Images were added to the journal, changed or deleted while
+        # browsing.  Follow the image on screen to its new position.
+        self.image_count = len(self.image_list)
+        self._grid.refresh()
+        if self._slideshow is not None:
+            self._slideshow.refresh()
+        if not self.update_current_image_index():
+            self.current_image_index = max(
+                0, min(self.current_image_index, self.image_count - 1))
+        if self._is_grid_shown():
+            self._grid.set_selected(self.current_image_index)
+        else:
+            self.traverse_update_sensitive()
+        self.list_set_visible(self._traverse_widgets, self.image_count > 1)
+
+    def _show_image_list(self):
         self.unbusy()
 
         if self.image_count == 0:
             # start new, or resume empty; with no images in journal
             # leave the "No image" message visible
-            return False
+            return
 
         if self.image_count > 1:
             # start new, or resume empty; with more than one image in journal
@@ -224,8 +300,6 @@ class ImageViewerActivity(activity.Activity):
         self.set_canvas(self.scrolled_window)
         self.scrolled_window.show()
 
-        return False
-
     def _add_toolbar_buttons(self, toolbar_box):
         self._seps = []
         self._image_buttons = []
@@ -311,6 +385,18 @@ class ImageViewerActivity(activity.Activity):
         toolbar_box.toolbar.insert(self.next_image_button, -1)
         self._traverse_widgets.append(self.next_image_button)
 
+        grid_button = ToolButton('view-box')
+        grid_button.set_tooltip(_('Thumbnails'))
+        grid_button.connect('clicked', self.__grid_cb)
+        toolbar_box.toolbar.insert(grid_button, -1)
+        self._traverse_widgets.append(grid_button)
+
+        slideshow_button = ToolButton('media-playback-start')
+        slideshow_button.set_tooltip(_('Slideshow'))
+        slideshow_button.connect('clicked', self.__slideshow_cb)
+        toolbar_box.toolbar.insert(slideshow_button, -1)
+        self._traverse_widgets.append(slideshow_button)
+
         self.list_set_visible(self._traverse_widgets, False)
 
         separator = Gtk.SeparatorToolItem()
@@ -334,6 +420,9 @@ class ImageViewerActivity(activity.Activity):
         self._zoom_out_button.set_sensitive(self.view.can_zoom_out())
 
     def _change_image(self, delta):
+        if self.image_list is None:
+            return
+
         # boundary conditions
         if self.current_image_index == 0 and delta == -1:
             return
@@ -343,9 +432,95 @@ class ImageViewerActivity(activity.Activity):
         self.current_image_index += delta
         self.traverse_update_sensitive()
 
+        # Wait for the page of the image to be queried.
+        self.image_list.load_around(self.current_image_index)
         jobject = self.image_list[self.current_image_index]
+        if jobject is None:
+            if self._load_hid is not None:
+                GLib.source_remove(self._load_hid)
+                self._load_hid = None
+            self._waiting_delta = delta
+            self.view.set_preview(None)
+            self.list_set_sensitive(self._image_buttons, False)
+            return
+        self._waiting_delta = None
         self._object_id = jobject.object_id
-        self.read_file(jobject.file_path)
+
+        # Skip the images passed while the previous one is still
+        # loading, only their preview is shown.
+        if self._load_hid is not None or self.view.is_loading():
+            self._show_preview(jobject)
+            if self._load_hid is not None:
+                GLib.source_remove(self._load_hid)
+            self._load_hid = GLib.timeout_add(BROWSE_DELAY, self.__load_cb,
+                                              delta)
+            return
+
+        self._load_image(jobject, delta)
+
+    def _load_image(self, jobject, delta):
+        # The image list removes the file of an object once nobody
+        # uses it, the image shown keeps its own link to it.
+        if not self.shared_activity:
+            file_path = self.image_list.request_file_path(
+                jobject.object_id, self.__file_path_cb)
+            if file_path is not None:
+                self._show_image_file(jobject.object_id, file_path)
+        self._prefetcher.update(self.image_list, self.current_image_index,
+                                delta, self._get_view_size())
+
+    def __file_path_cb(self, object_id, file_path):
+        if file_path is None:
+            logging.warning('No file for %s', object_id)
+        elif object_id != self._object_id or self.shared_activity:
+            self.image_list.release_file_path(object_id)
+        else:
+            self._show_image_file(object_id, file_path)
+
+    def _show_image_file(self, object_id, file_path):
+        try:
+            tempfile = self._tempfiles.acquire(file_path)
+        finally:
+            self.image_list.release_file_path(object_id)
+        self._show_file(tempfile)
+
+    def __load_cb(self, delta):
+        # The page of the image may have been dropped meanwhile, by a
+        # change in the journal.
+        self._load_hid = None
+        jobject = self.image_list[self.current_image_index]
+        if jobject is None:
+            self.image_list.load_around(self.current_image_index)
+            self._waiting_delta = delta
+            return False
+        self._load_image(jobject, delta)
+        return False
+
+    def _show_preview(self, jobject):
+        # An image decoded ahead of time is better than the preview.
+        # The image buttons wait for the file, in _show_file().
+        self._prefetcher.pause()
+        self.list_set_sensitive(self._image_buttons, False)
+        prepared = self._prefetcher.peek(jobject.object_id)
+        if prepared is not None:
+            self.view.set_preview(prepared.surface, prepared.orientation)
+            return
+
+        surface = None
+        preview = jobject.metadata.get('preview')
+        if preview:
+            try:
+                surface = decoder.decode_bytes(bytes(preview))
+            except (GLib.Error, TypeError, ValueError):
+                logging.debug('Invalid preview for %s', jobject.object_id)
+        self.view.set_preview(surface)
+
+    def _get_view_size(self):
+        # Before the view is shown, assume it will fill the screen.
+        alloc = self.view.get_allocation()
+        if alloc.width <= 1 or alloc.height <= 1:
+            return (Gdk.Screen.width(), Gdk.Screen.height())
+        return (alloc.width, alloc.height)
 
     def __previous_image_cb(self, button):
         if self.current_image_index > 0:
@@ -380,14 +555,91 @@ class ImageViewerActivity(activity.Activity):
     def __fullscreen_cb(self, button):
         self.fullscreen()
 
+    def _is_grid_shown(self):
+        return self.get_canvas() is self._grid_window
+
+    def __grid_cb(self, button):
+        if self._is_grid_shown():
+            self._show_view()
+            return
+
+        # Decoding for the view would slow down the thumbnails.
+        self._prefetcher.pause()
+        if self._load_hid is not None:
+            GLib.source_remove(self._load_hid)
+            self._load_hid = None
+
+        self._grid.set_image_list(self.image_list)
+        self._grid.set_selected(self.current_image_index)
+        self.list_set_sensitive(self._image_buttons, False)
+        self.previous_image_button.props.sensitive = False
+        self.next_image_button.props.sensitive = False
+        self.set_canvas(self._grid_window)
+        self._grid_window.show()
+
+    def _show_view(self):
+        self._grid.pause()
+        self.list_set_sensitive(self._image_buttons, self.view.has_file())
+        self.traverse_update_sensitive()
+        self.set_canvas(self.scrolled_window)
+        self.scrolled_window.show()
+
+    def __grid_image_activated_cb(self, grid, index):
+        jobject = self.image_list[index]
+        delta = index - self.current_image_index
+        self.current_image_index = index
+        self._waiting_delta = None
+        self._show_view()
+        if delta != 0:
+            self._object_id = jobject.object_id
+            self._load_image(jobject, delta)
+
+    def __slideshow_cb(self, button):
+        # The slideshow decodes its own images ahead.
+        self._prefetcher.pause()
+        self._grid.pause()
+        if self._load_hid is not None:
+            GLib.source_remove(self._load_hid)
+            self._load_hid = None
+
+        self._slideshow = slideshow.Slideshow(self.image_list,
+                                              self._rendition_cache)
+        self._slideshow.connect('button-press-event',
+                                self.__slideshow_button_press_cb)
+        self._slideshow.add_events(Gdk.EventMask.BUTTON_PRESS_MASK)
+        self.set_canvas(self._slideshow)
+        self._slideshow.show()
+        self.fullscreen()
+        self._slideshow.start(self.current_image_index)
+
+    def __slideshow_button_press_cb(self, widget, event):
+        self.unfullscreen()
+        return True
+
+    def unfullscreen(self):
+        # Leaving fullscreen, with the escape key too, ends the
+        # slideshow on the image it was showing.
+        activity.Activity.unfullscreen(self)
+        if self._slideshow is None:
+            return
+
+        object_id = self._slideshow.stop()
+        self._slideshow = None
+        self._show_view()
+
+        index = self.image_list.find(object_id)
+        if index is not None and object_id != self._object_id:
+            delta = index - self.current_image_index
+            self.current_image_index = index
+            self.traverse_update_sensitive()
+            self._object_id = object_id
+            self._load_image(self.image_list[index], delta)
+
     def update_current_image_index(self):
-        for image in self.image_list:
-            if image.object_id == self._object_id:
-                jobject = image
-                break
-        else:
+        index = self.image_list.find(self._object_id)
+        if index is None:
             return False
-        self.current_image_index = self.image_list.index(jobject)
+        self.current_image_index = index
         return True
 
     def list_set_visible(self, widgets, visible):
@@ -428,16 +680,19 @@ class ImageViewerActivity(activity.Activity):
             # but we need check if is not the case of empty file
             return
 
+        # The file given is removed once read, keep a link to it.
+        self._show_file(self._tempfiles.acquire(file_path))
+
+    def _show_file(self, file_location):
         # enable collaboration
         self.activity_button.page.share.props.sensitive = True
 
-        tempfile = os.path.join(self.get_activity_root(), 'instance',
-                                'tmp%f' % time.time())
-
-        os.link(file_path, tempfile)
-        self._tempfile = tempfile
+        self._tempfiles.release(self._tempfile)
+        self._tempfile = file_location
 
-        self.view.set_file_location(tempfile)
+        self.view.set_file_location(
+            file_location, self._prefetcher.take(self._object_id),
+            renditioncache.get_key(self._object_id, file_location))
         self.list_set_sensitive(self._image_buttons, True)
 
         zoom = self.metadata.get('zoom', None)
@@ -448,14 +703,21 @@ class ImageViewerActivity(activity.Activity):
         if self._tempfile:
             self.metadata['zoom'] = str(self.view.get_zoom())
             if self._close_requested:
-                os.link(self._tempfile, file_path)
-                os.unlink(self._tempfile)
+                try:
+                    os.link(self._tempfile, file_path)
+                except OSError as error:
+                    logging.error('Can not save %s: %s', self._tempfile,
+                                  error)
+                self._tempfiles.release(self._tempfile)
                 self._tempfile = None
         else:
             raise NotImplementedError
 
     def can_close(self):
         self._close_requested = True
+        if self.image_list is not None:
+            self.image_list.destroy()
+        self._rendition_cache.flush()
         return True
 
     def __incoming_file_cb(self, collab, ft, desc):
@@ -493,7 +755,9 @@ class ImageViewerActivity(activity.Activity):
 
     def __set_file_idle_cb(self, object_id):
         dsobj = datastore.get(object_id)
-        self._tempfile = dsobj.file_path
+        self._tempfiles.release(self._tempfile)
+        self._tempfile = self._tempfiles.acquire(dsobj.file_path)
+        dsobj.destroy()
         """ This method is used when join a collaboration session """
         self.view.set_file_location(self._tempfile)
         try:
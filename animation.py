@@ -0,0 +1,142 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import collections
+
+from gi.repository import GLib
+
+import decoder
+import memorybudget
+
+# Frames composited ahead of the one on screen.
+RING_SIZE = 8
+
+# Browsers show frames with a shorter delay for this long, many
+# animations rely on it.
+MIN_DELAY = 20
+DEFAULT_DELAY = 100
+
+
+def _time_val(milliseconds):
+    time_val = GLib.TimeVal()
+    time_val.tv_sec = milliseconds // 1000
+    time_val.tv_usec = (milliseconds % 1000) * 1000
+    return time_val
+
+
+class AnimationPlayer(object):
+    """
+    Play an animated image, timed by the frame clock of the view.
+
+    The frames are composited into cairo surfaces a few frames ahead
+    of the one on screen, one frame per idle callback, so memory
+    stays bounded however long the animation is and compositing
+    never blocks the main loop.
+    """
+
+    def __init__(self, animation, max_size):
+        # The animation is stepped on its own clock, starting at 0,
+        # one frame delay at a time.
+        self._time = 0
+        self._iter = animation.get_iter(_time_val(0))
+        self._at_end = False
+        self._ring = collections.deque()
+        self._fill_hid = None
+
+        self._frame = self._composite_next()
+        self._frame_end = None
+
+        # Don't hold more frames than the budget allows for a single
+        # image.
+        frame_size = memorybudget.get_surface_size(self._frame[0])
+        self._ring_size = max(1, min(RING_SIZE, max_size // frame_size))
+        self._schedule_fill()
+
+    def get_surface(self):
+        return self._frame[0]
+
+    def get_size(self):
+        # Bytes used by the frames held.
+        size = memorybudget.get_surface_size(self._frame[0])
+        for surface, delay in self._ring:
+            size += memorybudget.get_surface_size(surface)
+        return size
+
+    def is_playing(self):
+        # Animations that don't loop stop at their last frame.
+        return self._frame[1] is not None
+
+    def stop(self):
+        if self._fill_hid is not None:
+            GLib.source_remove(self._fill_hid)
+            self._fill_hid = None
+        self._ring.clear()
+
+    def _composite_next(self):
+        # The iterator gives the frame already composited over the
+        # previous ones, it only needs to be converted.
+        surface = decoder.surface_from_pixbuf(self._iter.get_pixbuf())
+        delay = self._iter.get_delay_time()
+        if delay < 0:
+            self._at_end = True
+            return (surface, None)
+
+        if delay == 0:
+            delay = DEFAULT_DELAY
+        delay = max(delay, MIN_DELAY)
+        self._time += delay
+        self._iter.advance(_time_val(self._time))
+        return (surface, delay)
+
+    def _schedule_fill(self):
+        if self._fill_hid is None and not self._at_end and \
+                len(self._ring) < self._ring_size:
+            self._fill_hid = GLib.idle_add(self.__fill_cb)
+
+    def __fill_cb(self):
+        self._ring.append(self._composite_next())
+        if self._at_end or len(self._ring) >= self._ring_size:
+            self._fill_hid = None
+            return False
+        return True
+
+    def tick(self, frame_time):
+        # Called on every frame with the frame clock time in seconds.
+        # Return True if the frame to show changed.
+        if not self.is_playing():
+            return False
+        if self._frame_end is None:
+            self._frame_end = frame_time + self._frame[1] / 1000.0
+            return False
+        if frame_time < self._frame_end:
+            return False
+
+        # If compositing fell behind, keep the current frame on
+        # screen a bit longer instead of skipping frames.
+        if not self._ring:
+            self._schedule_fill()
+            return False
+
+        self._frame = self._ring.popleft()
+        self._schedule_fill()
+
+        if self._frame[1] is not None:
+            self._frame_end += self._frame[1] / 1000.0
+            # Start over from now after a long stall, like when the
+            # view was hidden, instead of rushing through frames.
+            if self._frame_end < frame_time:
+                self._frame_end = frame_time + self._frame[1] / 1000.0
+        return True
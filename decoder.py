@@ -0,0 +1,440 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import cairo
+import itertools
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+from gi.repository import GLib
+from gi.repository import Gdk
+from gi.repository import GdkPixbuf
+
+import memorybudget
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import gi
+    gi.require_version('Rsvg', '2.0')
+    from gi.repository import Rsvg
+except (ImportError, ValueError):
+    Rsvg = None
+
+# Lower values are decoded first.
+PRIORITY_VISIBLE = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_THUMBNAIL = 2
+
+# Thumbnails are small and many, they are decoded by their own
+# threads, one per core, so they don't wait behind the image on
+# screen.
+THUMBNAIL_WORKERS = os.cpu_count() or 1
+
+# Bytes fed to the image loader at once.
+CHUNK_SIZE = 64 * 1024
+
+# Minimum time between two reports of a partially decoded image, in
+# seconds.
+PROGRESS_INTERVAL = 0.1
+
+
+class DecodeJob(object):
+    """
+    A function queued to run in a worker thread.  The callback is
+    called in the main loop with the result, or with None if the
+    function failed.  Cancelled jobs never call their callback.
+    """
+
+    def __init__(self, priority, func, args, callback,
+                 progress_callback=None):
+        self.priority = priority
+        self._func = func
+        self._args = args
+        self._callback = callback
+        self._progress_callback = progress_callback
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def is_cancelled(self):
+        # Long running functions receive the job as first argument
+        # and can check this to stop early.
+        return self._cancelled
+
+    def wants_progress(self):
+        # Partial results can be costly to make, there is no need to
+        # make them if nobody takes them.
+        return self._progress_callback is not None
+
+    def progress(self, *args):
+        # Called from the worker thread to hand partial results to
+        # the main loop.
+        if self._progress_callback is not None:
+            GLib.idle_add(self._report_progress, args)
+
+    def _report_progress(self, args):
+        if not self._cancelled:
+            self._progress_callback(*args)
+        return False
+
+    def run(self):
+        try:
+            return self._func(self, *self._args)
+        except Exception:
+            logging.exception('Error running decode job')
+            return None
+
+    def finish(self, result):
+        if not self._cancelled:
+            self._callback(result)
+        return False
+
+
+class DecodeQueue(object):
+    """
+    Priority queue of decode jobs served by background threads, so
+    decoding never blocks the GTK main loop.
+    """
+
+    def __init__(self, workers=1):
+        self._queue = queue.PriorityQueue()
+
+        # Jobs with the same priority run in submission order.
+        self._counter = itertools.count()
+
+        for i in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, priority, func, callback, *args,
+               progress_callback=None):
+        job = DecodeJob(priority, func, args, callback, progress_callback)
+        self._queue.put((priority, next(self._counter), job))
+        return job
+
+    def _work(self):
+        while True:
+            priority, order, job = self._queue.get()
+            if job.is_cancelled():
+                continue
+            result = job.run()
+            GLib.idle_add(job.finish, result)
+
+
+_decode_queue = None
+_thumbnail_queue = None
+
+
+def get_decode_queue():
+    global _decode_queue
+    if _decode_queue is None:
+        _decode_queue = DecodeQueue()
+    return _decode_queue
+
+
+def get_thumbnail_queue():
+    global _thumbnail_queue
+    if _thumbnail_queue is None:
+        _thumbnail_queue = DecodeQueue(THUMBNAIL_WORKERS)
+    return _thumbnail_queue
+
+
+# Position of the red, green, blue and alpha bytes of a cairo ARGB32
+# pixel, which is stored in native endian order.
+if sys.byteorder == 'little':
+    _ARGB32_CHANNELS = (2, 1, 0, 3)
+else:
+    _ARGB32_CHANNELS = (1, 2, 3, 0)
+
+
+def _pixbuf_to_argb32(pixels, target):
+    # Convert RGB or non-premultiplied RGBA pixels to premultiplied
+    # ARGB32, writing straight into the target array.
+    red, green, blue, alpha = _ARGB32_CHANNELS
+    if pixels.shape[2] == 3:
+        target[..., red] = pixels[..., 0]
+        target[..., green] = pixels[..., 1]
+        target[..., blue] = pixels[..., 2]
+        target[..., alpha] = 255
+        return
+
+    opacity = pixels[..., 3].astype(numpy.uint16)
+    for channel, index in ((red, 0), (green, 1), (blue, 2)):
+        # Same rounding as GDK, an approximation of x * a / 255.
+        value = pixels[..., index] * opacity + 0x80
+        target[..., channel] = ((value >> 8) + value) >> 8
+    target[..., alpha] = pixels[..., 3]
+
+
+def _copy_pixbuf_area(surface, pixbuf, x, y, width, height):
+    # Only convert the updated area, converting the whole pixbuf on
+    # every update would make streaming quadratic.
+    area = pixbuf.new_subpixbuf(x, y, width, height)
+
+    if numpy is not None:
+        n_channels = area.get_n_channels()
+        rowstride = area.get_rowstride()
+        pixels = numpy.lib.stride_tricks.as_strided(
+            numpy.frombuffer(area.get_pixels(), dtype=numpy.uint8),
+            shape=(height, width, n_channels),
+            strides=(rowstride, n_channels, 1))
+
+        surface.flush()
+        stride = surface.get_stride()
+        target = numpy.ndarray(shape=(height, width, 4), dtype=numpy.uint8,
+                               buffer=surface.get_data(),
+                               offset=y * stride + x * 4,
+                               strides=(stride, 4, 1))
+        _pixbuf_to_argb32(pixels, target)
+        surface.mark_dirty_rectangle(x, y, width, height)
+        return
+
+    # Without NumPy, let GDK convert the area through a temporary
+    # surface of the same size.
+    ctx = cairo.Context(surface)
+    ctx.set_operator(cairo.OPERATOR_SOURCE)
+    Gdk.cairo_set_source_pixbuf(ctx, area, x, y)
+    ctx.rectangle(x, y, width, height)
+    ctx.fill()
+
+
+def _get_argb32_array(surface):
+    width = surface.get_width()
+    height = surface.get_height()
+    return numpy.ndarray(shape=(height, width, 4), dtype=numpy.uint8,
+                         buffer=surface.get_data(),
+                         strides=(surface.get_stride(), 4, 1))
+
+
+def compact_surface(surface, has_alpha):
+    # Return the image of an ARGB32 surface in the smallest format
+    # that keeps it intact.  Gray images only need their gray level,
+    # stored as the alpha of an A8 surface.  Opaque images are marked
+    # as such, which makes drawing them faster, and on low memory
+    # devices they are reduced to 16 bits per pixel.
+    surface.flush()
+    width = surface.get_width()
+    height = surface.get_height()
+
+    if numpy is not None:
+        pixels = _get_argb32_array(surface)
+        red, green, blue, alpha = _ARGB32_CHANNELS
+        if has_alpha and (pixels[..., alpha] == 255).all():
+            has_alpha = False
+        if not has_alpha and \
+                (pixels[..., red] == pixels[..., green]).all() and \
+                (pixels[..., green] == pixels[..., blue]).all():
+            gray = cairo.ImageSurface(cairo.FORMAT_A8, width, height)
+            target = numpy.ndarray(shape=(height, width), dtype=numpy.uint8,
+                                   buffer=gray.get_data(),
+                                   strides=(gray.get_stride(), 1))
+            target[...] = pixels[..., red]
+            gray.mark_dirty()
+            return gray
+
+    if has_alpha:
+        return surface
+
+    if memorybudget.is_low_memory():
+        compact = cairo.ImageSurface(cairo.FORMAT_RGB16_565, width, height)
+        ctx = cairo.Context(compact)
+        ctx.set_operator(cairo.OPERATOR_SOURCE)
+        ctx.set_source_surface(surface, 0, 0)
+        ctx.paint()
+        return compact
+
+    # The pixels of an opaque ARGB32 surface are valid RGB24 pixels,
+    # the memory is shared.
+    return cairo.ImageSurface.create_for_data(
+        surface.get_data(), cairo.FORMAT_RGB24, width, height,
+        surface.get_stride())
+
+
+def _snapshot_surface(surface):
+    # Copy of the surface for the main loop to paint, while the worker
+    # thread keeps writing to the surface.
+    snapshot = cairo.ImageSurface(surface.get_format(), surface.get_width(),
+                                  surface.get_height())
+    ctx = cairo.Context(snapshot)
+    ctx.set_operator(cairo.OPERATOR_SOURCE)
+    ctx.set_source_surface(surface, 0, 0)
+    ctx.paint()
+    snapshot.flush()
+    return snapshot
+
+
+class _StreamingDecoder(object):
+
+    def __init__(self, job, width, height):
+        self._job = job
+        self._size = (width, height)
+        self._surface = None
+        self._has_alpha = True
+        self._truncated = False
+        self._last_progress = 0
+
+        self._loader = GdkPixbuf.PixbufLoader()
+        self._loader.connect('size-prepared', self.__size_prepared_cb)
+        self._loader.connect('area-prepared', self.__area_prepared_cb)
+        self._loader.connect('area-updated', self.__area_updated_cb)
+
+    def __size_prepared_cb(self, loader, width, height):
+        if self._size[0] is not None:
+            loader.set_size(*self._size)
+
+    def __area_prepared_cb(self, loader):
+        pixbuf = loader.get_pixbuf()
+        self._has_alpha = pixbuf.get_has_alpha()
+        self._surface = cairo.ImageSurface(
+            cairo.FORMAT_ARGB32, pixbuf.get_width(), pixbuf.get_height())
+        if self._job.wants_progress():
+            self._job.progress(_snapshot_surface(self._surface))
+
+    def __area_updated_cb(self, loader, x, y, width, height):
+        _copy_pixbuf_area(self._surface, loader.get_pixbuf(),
+                          x, y, width, height)
+
+        # Progressive and interlaced images update the whole image
+        # several times, coarse to fine.  Others update it from top
+        # to bottom.  Either way, the view can show what is decoded
+        # so far.  It gets a copy, the surface is only touched by the
+        # worker thread until it is done.
+        if not self._job.wants_progress():
+            return
+        now = time.time()
+        if now - self._last_progress >= PROGRESS_INTERVAL:
+            self._last_progress = now
+            self._job.progress(_snapshot_surface(self._surface))
+
+    def decode(self, file_location):
+        with open(file_location, 'rb') as image_file:
+            while not self._job.is_cancelled():
+                data = image_file.read(CHUNK_SIZE)
+                if not data:
+                    break
+                self._loader.write(data)
+
+        try:
+            self._loader.close()
+        except GLib.Error as error:
+            self._loader = None
+            if self._job.is_cancelled():
+                return None
+            # A truncated file still shows the part that could be
+            # decoded.
+            logging.warning('Error decoding %s: %s', file_location, error)
+            if self._surface is None:
+                raise
+            self._truncated = True
+
+        # Release the pixbuf now, the surface is all the view needs.
+        # The loader keeps its full-size pixbuf for the whole decode
+        # and the surface is filled alongside it, so the peak memory
+        # of a decode is still the pixbuf plus the surface, like
+        # decoding the whole file and painting it.  Only decoding at a
+        # reduced size makes it smaller.
+        self._loader = None
+
+        if self._job.is_cancelled():
+            return None
+
+        # The missing part of a truncated image is transparent.
+        if self._truncated:
+            return self._surface
+        return compact_surface(self._surface, self._has_alpha)
+
+
+def decode_surface(job, file_location, width=None, height=None):
+    # Decode the file in a streaming way, reporting the partially
+    # decoded surface to the job progress callback.  If a size is
+    # given, the image is decoded at that size.  This is cheaper than
+    # decoding it at full size and scaling it later, the JPEG loader
+    # even skips most of the work.
+    return _StreamingDecoder(job, width, height).decode(file_location)
+
+
+def decode_animation(job, file_location):
+    # Load an animated image.  The frames are composited later, one
+    # at a time, by the animation player.
+    loader = GdkPixbuf.PixbufLoader()
+    with open(file_location, 'rb') as image_file:
+        while not job.is_cancelled():
+            data = image_file.read(CHUNK_SIZE)
+            if not data:
+                break
+            loader.write(data)
+
+    try:
+        loader.close()
+    except GLib.Error as error:
+        if job.is_cancelled():
+            return None
+        logging.warning('Error decoding %s: %s', file_location, error)
+        if loader.get_animation() is None:
+            raise
+
+    if job.is_cancelled():
+        return None
+    return loader.get_animation()
+
+
+def load_svg(job, file_location):
+    # Parse a vector image.  The handle is rendered later in the main
+    # loop, at the zoom of the view.
+    return Rsvg.Handle.new_from_file(file_location)
+
+
+def decode_svg(job, file_location, width, height):
+    # Render a vector image at the given size.  The handle is parsed
+    # again here as handles can't be used from two threads at once.
+    handle = Rsvg.Handle.new_from_file(file_location)
+    if job.is_cancelled():
+        return None
+
+    dimensions = handle.get_dimensions()
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    ctx = cairo.Context(surface)
+    ctx.scale(width * 1.0 / dimensions.width,
+              height * 1.0 / dimensions.height)
+    handle.render_cairo(ctx)
+    return surface
+
+
+def decode_bytes(data):
+    # Decode a small image held in memory, like an embedded
+    # thumbnail.  This runs in the calling thread.
+    loader = GdkPixbuf.PixbufLoader()
+    loader.write(data)
+    loader.close()
+    return surface_from_pixbuf(loader.get_pixbuf())
+
+
+def surface_from_pixbuf(pixbuf):
+    width = pixbuf.get_width()
+    height = pixbuf.get_height()
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    _copy_pixbuf_area(surface, pixbuf, 0, 0, width, height)
+    return surface
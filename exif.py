@@ -0,0 +1,139 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Minimal Exif reader.  It only reads the start of the file to get the
+orientation of the image and the embedded thumbnail, if any.
+'''
+
+import struct
+
+# Bytes read from the start of the file.  The Exif segment of a JPEG
+# file is at most 64 KiB and comes right after the start of image.
+HEADER_SIZE = 128 * 1024
+
+ORIENTATION_TAG = 0x0112
+THUMBNAIL_OFFSET_TAG = 0x0201
+THUMBNAIL_LENGTH_TAG = 0x0202
+
+_SHORT = 3
+_LONG = 4
+
+# Exif orientation to a horizontal mirror flag and the number of
+# clockwise quarter turns to apply after mirroring.
+TRANSFORMS = {
+    1: (False, 0),
+    2: (True, 0),
+    3: (False, 2),
+    4: (True, 2),
+    5: (True, 3),
+    6: (False, 1),
+    7: (True, 1),
+    8: (False, 3),
+}
+
+
+def _read_ifd(data, offset, endian):
+    # Return the integer values of an image file directory, and the
+    # offset of the next one.
+    values = {}
+    count = struct.unpack_from(endian + 'H', data, offset)[0]
+    for i in range(count):
+        tag, value_type, value_count = struct.unpack_from(
+            endian + 'HHI', data, offset + 2 + i * 12)
+        if value_count != 1:
+            continue
+        if value_type == _SHORT:
+            values[tag] = struct.unpack_from(
+                endian + 'H', data, offset + 10 + i * 12)[0]
+        elif value_type == _LONG:
+            values[tag] = struct.unpack_from(
+                endian + 'I', data, offset + 10 + i * 12)[0]
+
+    next_offset = struct.unpack_from(endian + 'I', data,
+                                     offset + 2 + count * 12)[0]
+    return values, next_offset
+
+
+def _parse_tiff(data):
+    if data[:2] == b'II':
+        endian = '<'
+    elif data[:2] == b'MM':
+        endian = '>'
+    else:
+        return (1, None)
+
+    try:
+        magic, offset = struct.unpack_from(endian + 'HI', data, 2)
+        if magic != 42:
+            return (1, None)
+
+        values, offset = _read_ifd(data, offset, endian)
+        orientation = values.get(ORIENTATION_TAG, 1)
+
+        # The second directory describes the thumbnail.
+        thumbnail = None
+        if offset != 0:
+            values, offset = _read_ifd(data, offset, endian)
+            start = values.get(THUMBNAIL_OFFSET_TAG)
+            length = values.get(THUMBNAIL_LENGTH_TAG)
+            if start is not None and length is not None:
+                thumbnail = data[start:start + length]
+                if len(thumbnail) != length or \
+                        not thumbnail.startswith(b'\xff\xd8'):
+                    thumbnail = None
+    except struct.error:
+        return (1, None)
+
+    if orientation not in TRANSFORMS:
+        orientation = 1
+    return (orientation, thumbnail)
+
+
+def read_exif(file_location):
+    # Return the Exif orientation of the image and the bytes of the
+    # embedded JPEG thumbnail, or None if there is no thumbnail.
+    with open(file_location, 'rb') as image_file:
+        data = image_file.read(HEADER_SIZE)
+
+    # TIFF files have the Exif tags in their first directory.
+    if data[:4] in (b'II*\x00', b'MM\x00*'):
+        return (_parse_tiff(data)[0], None)
+
+    if data[:2] != b'\xff\xd8':
+        return (1, None)
+
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xff:
+            break
+        marker = data[position + 1]
+        if marker == 0xff:
+            # Fill byte.
+            position += 1
+            continue
+        if marker in (0xd9, 0xda):
+            # End of image or start of the compressed data, there
+            # are no more headers.
+            break
+
+        length = struct.unpack_from('>H', data, position + 2)[0]
+        segment = data[position + 4:position + 2 + length]
+        if marker == 0xe1 and segment.startswith(b'Exif\x00\x00'):
+            return _parse_tiff(segment[6:])
+        position += 2 + length
+
+    return (1, None)
@@ -0,0 +1,348 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import dbus
+import functools
+import logging
+import os
+
+from sugar3 import mime
+from sugar3.datastore import datastore
+
+# Journal entries queried at once.
+PAGE_SIZE = 50
+
+# The next page is queried when browsing gets this close to its end.
+LOAD_AHEAD = 10
+
+# The preview is shown while browsing quickly, the rest of the
+# metadata is not needed.
+PROPERTIES = ['uid', 'title', 'mime_type', 'timestamp', 'preview']
+
+SORTING = ['-timestamp']
+
+DS_DBUS_SERVICE = 'org.laptop.sugar.DataStore'
+DS_DBUS_INTERFACE = 'org.laptop.sugar.DataStore'
+DS_DBUS_PATH = '/org/laptop/sugar/DataStore'
+
+_data_store = None
+
+
+def _get_data_store():
+    global _data_store
+    if _data_store is None:
+        bus = dbus.SessionBus()
+        _data_store = dbus.Interface(
+            bus.get_object(DS_DBUS_SERVICE, DS_DBUS_PATH), DS_DBUS_INTERFACE)
+    return _data_store
+
+
+def _remove_file(file_path):
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass
+
+
+def _get_timestamp(metadata):
+    # Timestamps may come as strings from the datastore.
+    try:
+        return float(metadata.get('timestamp', 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+class ImageList(object):
+    """
+    The images in the journal, newest first like in the journal.
+
+    They are queried a page at a time, asynchronously, as browsing
+    gets close to them.  Images not loaded yet are None.  The
+    page_loaded_cb callback is called with the page number each time
+    a page is loaded, or failed to load.
+
+    The list follows the changes to the journal without querying it
+    again: new images are added in their place, changed ones updated
+    and deleted ones removed, then changed_cb is called.  The position
+    of every loaded image is indexed by its object id.
+
+    The positions must stay those of the journal query, or the pages
+    queried later would land in the wrong place.  A change whose
+    place falls among images not loaded yet is recorded as an image
+    not loaded, and a change whose place is not known at all unloads
+    the images after the first one not loaded.
+
+    The files of the images are asked to the datastore asynchronously,
+    the datastore gives a copy that belongs to the list.  It is
+    removed once its last user releases it, or when the image leaves
+    the list, users that keep the file longer must link it.
+    """
+
+    def __init__(self, page_loaded_cb, changed_cb):
+        mime_types = mime.get_generic_type(mime.GENERIC_TYPE_IMAGE).mime_types
+        self._query = {'mime_type': mime_types}
+        self._page_loaded_cb = page_loaded_cb
+        self._changed_cb = changed_cb
+        self._count = None
+        self._images = []
+        self._positions = {}
+        self._pending = set()
+        self._file_paths = {}
+        self._file_users = {}
+        self._file_requests = {}
+
+        datastore.created.connect(self.__created_cb)
+        datastore.updated.connect(self.__updated_cb)
+        datastore.deleted.connect(self.__deleted_cb)
+
+    def __len__(self):
+        return len(self._images)
+
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self._images):
+            raise IndexError('Image index out of range')
+        return self._images[index]
+
+    def find(self, object_id):
+        # Position of the journal object among the loaded images.
+        return self._positions.get(object_id)
+
+    def request_file_path(self, object_id, callback):
+        # Return the path of the file of a loaded image, if known.  If
+        # not, it is asked to the datastore and the callback called
+        # with the object id and the path, or None if there is none.
+        # Each path handed out, returned or given to the callback, is
+        # released with release_file_path() once done with.
+        file_path = self._file_paths.get(object_id)
+        if file_path is not None:
+            self._file_users[object_id] += 1
+            return file_path
+
+        callbacks = self._file_requests.get(object_id)
+        if callbacks is None:
+            callbacks = self._file_requests[object_id] = []
+            _get_data_store().get_filename(
+                object_id,
+                reply_handler=functools.partial(self.__file_path_cb,
+                                                object_id),
+                error_handler=functools.partial(self.__file_path_error_cb,
+                                                object_id))
+        if callback not in callbacks:
+            callbacks.append(callback)
+        return None
+
+    def __file_path_cb(self, object_id, file_path):
+        file_path = str(file_path) or None
+        callbacks = self._file_requests.pop(object_id, [])
+        if object_id not in self._positions and file_path is not None:
+            # The image left the list meanwhile.
+            _remove_file(file_path)
+            file_path = None
+        elif file_path is not None:
+            self._file_paths[object_id] = file_path
+            self._file_users[object_id] = len(callbacks)
+
+        for callback in callbacks:
+            callback(object_id, file_path)
+
+    def release_file_path(self, object_id):
+        # The file is removed once nobody uses it, the datastore makes
+        # a new one when it is asked again.
+        if object_id not in self._file_users:
+            return
+        self._file_users[object_id] -= 1
+        if self._file_users[object_id] > 0:
+            return
+        del self._file_users[object_id]
+        _remove_file(self._file_paths.pop(object_id))
+
+    def __file_path_error_cb(self, object_id, error):
+        logging.error('Error getting the file of %s: %s', object_id, error)
+        for callback in self._file_requests.pop(object_id, []):
+            callback(object_id, None)
+
+    def destroy(self):
+        # Remove the files of the images.
+        for file_path in self._file_paths.values():
+            _remove_file(file_path)
+        self._file_paths = {}
+        self._file_users = {}
+        datastore.created.disconnect(self.__created_cb)
+        datastore.updated.disconnect(self.__updated_cb)
+        datastore.deleted.disconnect(self.__deleted_cb)
+
+    def load_page(self, number):
+        if number < 0 or number in self._pending:
+            return
+        start = number * PAGE_SIZE
+        if self._count is not None and (
+                start >= self._count or
+                None not in self._images[start:start + PAGE_SIZE]):
+            return
+
+        self._pending.add(number)
+        datastore.find(self._query, sorting=SORTING, limit=PAGE_SIZE,
+                       offset=start, properties=PROPERTIES,
+                       reply_handler=functools.partial(self.__reply_cb,
+                                                       number),
+                       error_handler=functools.partial(self.__error_cb,
+                                                       number))
+
+    def load_around(self, index):
+        # Load the page of the image, and the next or previous one
+        # when the image is close to its border.
+        number = index // PAGE_SIZE
+        self.load_page(number)
+        if index % PAGE_SIZE >= PAGE_SIZE - LOAD_AHEAD:
+            self.load_page(number + 1)
+        elif index % PAGE_SIZE < LOAD_AHEAD:
+            self.load_page(number - 1)
+
+    def _set_count(self, count):
+        self._count = count
+        for position in range(count, len(self._images)):
+            self._forget(position)
+        del self._images[count:]
+        self._images.extend([None] * (count - len(self._images)))
+
+    def _index_from(self, start):
+        for position in range(start, len(self._images)):
+            jobject = self._images[position]
+            if jobject is not None:
+                self._positions[jobject.object_id] = position
+
+    def _forget(self, position):
+        # Mark the image at the position as not loaded.
+        jobject = self._images[position]
+        if jobject is not None:
+            del self._positions[jobject.object_id]
+            self._images[position] = None
+            file_path = self._file_paths.pop(jobject.object_id, None)
+            if file_path is not None:
+                del self._file_users[jobject.object_id]
+                _remove_file(file_path)
+            jobject.destroy()
+
+    def _forget_after_gap(self):
+        # Something changed at an unknown position among the images
+        # not loaded, the ones loaded after them may have moved.
+        if None not in self._images:
+            return
+        for position in range(self._images.index(None), len(self._images)):
+            self._forget(position)
+
+    def _insert_sorted(self, jobject):
+        # Insert the image before the first loaded one that is older.
+        # If images not loaded come before that one, the image could
+        # be anywhere among them, a slot not loaded is inserted
+        # instead and the image comes with its page.
+        timestamp = _get_timestamp(jobject.metadata)
+        position = len(self._images)
+        for index, other in enumerate(self._images):
+            if other is not None and \
+                    _get_timestamp(other.metadata) <= timestamp:
+                position = index
+                break
+        if position > 0 and self._images[position - 1] is None:
+            jobject = None
+
+        self._images.insert(position, jobject)
+        self._count += 1
+        self._index_from(position)
+
+    def _remove(self, position):
+        self._forget(position)
+        del self._images[position]
+        self._count -= 1
+        self._index_from(position)
+
+    def __reply_cb(self, number, entries, count):
+        self._pending.discard(number)
+        self._set_count(count)
+
+        # The journal may have changed since the query was sent, the
+        # reply wins over what was there.
+        for position, properties in enumerate(entries, number * PAGE_SIZE):
+            if position >= len(self._images):
+                break
+            object_id = properties.pop('uid')
+            known = self._positions.get(object_id)
+            if known == position:
+                continue
+            if known is not None:
+                self._forget(known)
+
+            self._forget(position)
+            self._images[position] = datastore.DSObject(
+                object_id, datastore.DSMetadata(properties), None)
+            self._positions[object_id] = position
+        self._page_loaded_cb(number)
+
+    def __error_cb(self, number, error):
+        self._pending.discard(number)
+        logging.error('Error querying the journal images: %s', error)
+        if self._count is None:
+            self._set_count(0)
+        self._page_loaded_cb(number)
+
+    def _query_object(self, object_id, created):
+        query = dict(self._query)
+        query['uid'] = object_id
+        datastore.find(query, properties=PROPERTIES,
+                       reply_handler=functools.partial(self.__object_reply_cb,
+                                                       object_id, created),
+                       error_handler=self.__object_error_cb)
+
+    def __created_cb(self, sender, object_id=None, **kwargs):
+        if self._count is not None:
+            self._query_object(object_id, True)
+
+    def __updated_cb(self, sender, object_id=None, **kwargs):
+        # The object may have become an image, or stopped being one,
+        # and a new timestamp moves it.
+        if self._count is not None:
+            self._query_object(object_id, False)
+
+    def __deleted_cb(self, sender, object_id=None, **kwargs):
+        if self._count is None:
+            return
+        position = self._positions.get(object_id)
+        if position is not None:
+            self._remove(position)
+        else:
+            # It may have been an image not loaded yet.  The count is
+            # corrected by the next reply.
+            self._forget_after_gap()
+        self._changed_cb()
+
+    def __object_reply_cb(self, object_id, created, entries, count):
+        position = self._positions.get(object_id)
+        if position is not None:
+            self._remove(position)
+        elif not created:
+            # A changed object not loaded may have been an image
+            # among the ones not loaded yet.
+            self._forget_after_gap()
+
+        if entries:
+            properties = entries[0]
+            properties.pop('uid')
+            self._insert_sorted(datastore.DSObject(
+                object_id, datastore.DSMetadata(properties), None))
+        self._changed_cb()
+
+    def __object_error_cb(self, error):
+        logging.error('Error querying a changed journal object: %s', error)
@@ -0,0 +1,190 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import collections
+import logging
+import os
+
+from gi.repository import GLib
+
+# Fraction of the physical memory that decoded pixels may use.
+MEMORY_FRACTION = 0.25
+
+# Budget used when the physical memory can't be read.
+DEFAULT_BUDGET = 64 * 1024 * 1024
+
+# Fraction of the budget a single decoded image may use.  Bigger
+# images are decoded at a reduced size.
+IMAGE_FRACTION = 0.5
+
+# Devices with less physical memory than this keep images in compact
+# pixel formats, even if some color depth is lost.
+LOW_MEMORY_LIMIT = 1024 * 1024 * 1024
+
+PRESSURE_FILE = '/proc/pressure/memory'
+
+# Notify when tasks stalled on memory for 150 ms in a 2 s window.
+# Unprivileged processes can only use windows multiple of 2 s.
+PRESSURE_TRIGGER = b'some 150000 2000000\0'
+
+# When triggers are not available, poll the 10 s average of stalled
+# time, in percent, every few seconds.
+PRESSURE_THRESHOLD = 10.0
+PRESSURE_INTERVAL = 3
+
+
+def _get_total_memory():
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+_low_memory = None
+
+
+def is_low_memory():
+    global _low_memory
+    if _low_memory is None:
+        total = _get_total_memory()
+        _low_memory = total is not None and total < LOW_MEMORY_LIMIT
+    return _low_memory
+
+
+def get_surface_size(surface):
+    # Bytes used by the pixels of a cairo image surface.
+    return surface.get_stride() * surface.get_height()
+
+
+class MemoryBudget(object):
+    """
+    Accounting of the memory used by all decoded images, pyramid
+    levels and caches.
+
+    Each user adds entries with their size and a callback to drop
+    them.  When the budget is exceeded, the least recently used
+    entries are dropped.  Entries without callback, like the image
+    on screen, are counted but never dropped.
+    """
+
+    def __init__(self, limit=None):
+        if limit is None:
+            total = _get_total_memory()
+            if total is None:
+                limit = DEFAULT_BUDGET
+            else:
+                limit = int(total * MEMORY_FRACTION)
+        self._limit = limit
+        self._used = 0
+        self._entries = collections.OrderedDict()
+
+    def get_max_image_size(self):
+        return int(self._limit * IMAGE_FRACTION)
+
+    def add(self, key, size, evict_cb=None):
+        # Adding an existing key updates its size and marks it as
+        # recently used.
+        self.remove(key)
+        self._entries[key] = (size, evict_cb)
+        self._used += size
+        self._evict(self._limit, key)
+
+    def remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._used -= entry[0]
+
+    def shed(self):
+        # Drop everything that can be dropped.
+        logging.debug('Shedding %d bytes of cached images', self._used)
+        self._evict(0, None)
+
+    def _evict(self, target, keep):
+        for key in list(self._entries.keys()):
+            if self._used <= target:
+                break
+            size, evict_cb = self._entries[key]
+            if evict_cb is None or key == keep:
+                continue
+            self.remove(key)
+            evict_cb(key)
+
+
+class PressureMonitor(object):
+    """
+    Shed the caches of a budget when the kernel reports memory
+    pressure, through PSI triggers or by polling the PSI averages.
+    """
+
+    def __init__(self, budget):
+        self._budget = budget
+        self._fd = None
+
+        if not os.path.exists(PRESSURE_FILE):
+            return
+
+        try:
+            self._fd = os.open(PRESSURE_FILE, os.O_RDWR | os.O_NONBLOCK)
+            os.write(self._fd, PRESSURE_TRIGGER)
+        except OSError:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+            GLib.timeout_add_seconds(PRESSURE_INTERVAL, self.__poll_cb)
+            return
+
+        GLib.io_add_watch(self._fd, GLib.PRIORITY_DEFAULT,
+                          GLib.IOCondition.PRI | GLib.IOCondition.ERR,
+                          self.__trigger_cb)
+
+    def __trigger_cb(self, fd, condition):
+        if condition & GLib.IOCondition.ERR:
+            os.close(self._fd)
+            self._fd = None
+            return False
+        self._budget.shed()
+        return True
+
+    def __poll_cb(self):
+        try:
+            with open(PRESSURE_FILE) as pressure:
+                for line in pressure:
+                    fields = line.split()
+                    if fields[0] == 'some':
+                        avg10 = float(fields[1].split('=')[1])
+                        if avg10 >= PRESSURE_THRESHOLD:
+                            self._budget.shed()
+                        break
+        except (IOError, OSError, IndexError, ValueError):
+            return False
+        return True
+
+
+_memory_budget = None
+_pressure_monitor = None
+
+
+def get_memory_budget():
+    global _memory_budget
+    global _pressure_monitor
+    if _memory_budget is None:
+        _memory_budget = MemoryBudget()
+        _pressure_monitor = PressureMonitor(_memory_budget)
+    return _memory_budget
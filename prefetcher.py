@@ -0,0 +1,149 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import functools
+
+import decoder
+import memorybudget
+import renditioncache
+import ImageView
+
+# Images decoded ahead in the direction of browsing, and behind it.
+AHEAD = 3
+BEHIND = 1
+
+
+class Prefetcher(object):
+    """
+    Decode the journal images next to the one on screen, so they show
+    at once when the user moves to them.
+
+    More images are decoded in the direction the user is browsing.
+    The decoded images are accounted in the memory budget and dropped
+    first when memory is short.  They are stored in the rendition
+    cache too, if one is given.
+    """
+
+    def __init__(self, rendition_cache=None):
+        self._rendition_cache = rendition_cache
+        self._budget = memorybudget.get_memory_budget()
+        self._direction = 1
+        self._jobs = {}
+        self._images = {}
+
+        # What the last update asked for, decoded as the files of the
+        # images arrive.
+        self._image_list = None
+        self._wanted = []
+        self._view_size = None
+
+    def _get_key(self, object_id):
+        return ('prefetch', object_id)
+
+    def take(self, object_id):
+        # Return the image prepared for the journal object, if it is
+        # ready, and forget it.  It now belongs to the view.
+        if object_id in self._jobs:
+            self._cancel(object_id)
+
+        self._budget.remove(self._get_key(object_id))
+        return self._images.pop(object_id, None)
+
+    def peek(self, object_id):
+        # Return the image prepared for the journal object, if it is
+        # ready, and keep it.
+        return self._images.get(object_id)
+
+    def pause(self):
+        # Stop decoding, but keep the images already decoded.
+        for object_id in list(self._jobs.keys()):
+            self._cancel(object_id)
+        self._wanted = []
+
+    def _cancel(self, object_id):
+        self._jobs.pop(object_id).cancel()
+        self._image_list.release_file_path(object_id)
+
+    def update(self, image_list, index, delta, view_size):
+        # Called after moving by delta to the image at index.
+        if delta != 0:
+            self._direction = 1 if delta > 0 else -1
+
+        positions = [index + step * self._direction
+                     for step in range(1, AHEAD + 1)]
+        positions += [index - step * self._direction
+                      for step in range(1, BEHIND + 1)]
+        wanted = [image_list[position] for position in positions
+                  if 0 <= position < len(image_list)]
+        wanted = [jobject for jobject in wanted if jobject is not None]
+        wanted_ids = [jobject.object_id for jobject in wanted]
+
+        for object_id in list(self._jobs.keys()):
+            if object_id not in wanted_ids:
+                self._cancel(object_id)
+        for object_id in list(self._images.keys()):
+            if object_id not in wanted_ids:
+                self._drop(object_id)
+
+        self._wanted = []
+        if view_size[0] <= 1 or view_size[1] <= 1:
+            return
+        self._image_list = image_list
+        self._wanted = wanted_ids
+        self._view_size = view_size
+        self._submit()
+
+    def _submit(self):
+        # Jobs with the same priority run in order, the closest
+        # images whose file is known first.  Their files are released
+        # once they are decoded.
+        for object_id in self._wanted:
+            if object_id in self._jobs or object_id in self._images:
+                continue
+            file_path = self._image_list.request_file_path(
+                object_id, self.__file_path_cb)
+            if file_path is None:
+                continue
+            self._jobs[object_id] = decoder.get_decode_queue().submit(
+                decoder.PRIORITY_PREFETCH, ImageView.prepare_image,
+                functools.partial(self.__prepared_cb, object_id),
+                file_path, self._view_size, self._rendition_cache,
+                renditioncache.get_key(object_id, file_path))
+
+    def __file_path_cb(self, object_id, file_path):
+        # The jobs are submitted in order, asking for the files again.
+        if file_path is None:
+            return
+        if object_id in self._wanted:
+            self._submit()
+        self._image_list.release_file_path(object_id)
+
+    def _drop(self, object_id):
+        self._budget.remove(self._get_key(object_id))
+        del self._images[object_id]
+
+    def __prepared_cb(self, object_id, image):
+        self._jobs.pop(object_id, None)
+        self._image_list.release_file_path(object_id)
+        if image is None:
+            return
+        self._images[object_id] = image
+        self._budget.add(self._get_key(object_id),
+                         memorybudget.get_surface_size(image.surface),
+                         self.__evicted_cb)
+
+    def __evicted_cb(self, key):
+        self._images.pop(key[1], None)
@@ -0,0 +1,312 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import cairo
+import concurrent.futures
+import math
+import os
+
+TILE_SIZE = 256
+
+# Threads drawing the image with a slow filter.
+WORKERS = os.cpu_count() or 1
+
+# Smaller areas are drawn in a single band, splitting them would cost
+# more than it saves.
+MIN_BAND_HEIGHT = 64
+MIN_PARALLEL_AREA = 256 * 256
+
+# Filters slow enough to be worth spreading across threads.
+PARALLEL_FILTERS = (cairo.FILTER_GOOD, cairo.FILTER_BEST)
+
+
+def _paint_half(ctx, source, x, y, width, height, offset_x, offset_y):
+    # Fill the (x, y, width, height) rectangle of the context with
+    # the source surface reduced to half its size.  The offset is
+    # the position of the source in the coordinates of the context,
+    # at the reduced size.
+    pattern = cairo.SurfacePattern(source)
+    pattern.set_matrix(cairo.Matrix(2, 0, 0, 2, -2 * offset_x, -2 * offset_y))
+    pattern.set_filter(cairo.FILTER_BILINEAR)
+
+    # Repeat the border pixels instead of fading to transparent at
+    # the edges of an odd sized level.
+    pattern.set_extend(cairo.EXTEND_PAD)
+
+    ctx.set_source(pattern)
+    ctx.rectangle(x, y, width, height)
+    ctx.fill()
+
+
+_pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS)
+    return _pool
+
+
+def _get_device_box(ctx):
+    # Whole device pixels covering the clip of the context.
+    ctx.save()
+    ctx.identity_matrix()
+    x1, y1, x2, y2 = ctx.clip_extents()
+    ctx.restore()
+    x1 = int(math.floor(x1))
+    y1 = int(math.floor(y1))
+    return (x1, y1, int(math.ceil(x2)) - x1, int(math.ceil(y2)) - y1)
+
+
+def _fill_pattern(ctx, pattern, gray):
+    # Fill the current path with the pattern.  Gray images are stored
+    # in A8 surfaces whose alpha is the gray level, painting white
+    # through them over black gives the gray back.
+    if not gray:
+        ctx.set_source(pattern)
+        ctx.fill()
+        return
+
+    ctx.save()
+    ctx.clip()
+    ctx.set_source_rgb(0, 0, 0)
+    ctx.paint()
+    ctx.set_source_rgb(1, 1, 1)
+    ctx.mask(pattern)
+    ctx.restore()
+
+
+class TiledPyramid(object):
+    """
+    Multi-resolution version of an image surface.
+
+    Level 0 is the surface itself and every following level is half
+    the size of the previous one.  Levels are split in square tiles,
+    which are only rendered the first time they are needed to paint
+    the screen.
+
+    Missing tiles are rendered in parallel, and big areas are drawn
+    with the slow filters in bands, one per thread.  Cairo does not
+    hold the interpreter lock while painting, so this uses all the
+    cores.  Threads only read the tiles, they are all rendered
+    before drawing starts.
+
+    Tiles have the pixel format of the surface, so compact surfaces
+    give compact tiles.
+    """
+
+    def __init__(self, surface):
+        self._surface = surface
+        self._gray = surface.get_format() == cairo.FORMAT_A8
+        self._tiles = {}
+        self._tiles_size = 0
+
+        width = surface.get_width()
+        height = surface.get_height()
+        self._levels = [(width, height)]
+        while width > TILE_SIZE or height > TILE_SIZE:
+            width = (width + 1) // 2
+            height = (height + 1) // 2
+            self._levels.append((width, height))
+
+    def get_tiles_size(self):
+        # Bytes used by the rendered tiles, level 0 is not counted as
+        # it is the surface itself.
+        return self._tiles_size
+
+    def clear(self):
+        # Drop the rendered tiles, they will be rendered again when
+        # needed.
+        self._tiles = {}
+        self._tiles_size = 0
+
+    def get_level_for_scale(self, scale):
+        # Pick the smallest level that still has at least one pixel
+        # for each pixel on the screen, so it is never magnified.
+        if scale >= 1:
+            return 0
+        level = int(math.floor(-math.log(scale, 2)))
+        return min(level, len(self._levels) - 1)
+
+    def _get_children(self, level, col, row):
+        # Tiles of the previous level covered by a tile, less at the
+        # right and bottom borders.
+        prev_width, prev_height = self._levels[level - 1]
+        children = []
+        for child_row in (row * 2, row * 2 + 1):
+            if child_row * TILE_SIZE >= prev_height:
+                continue
+            for child_col in (col * 2, col * 2 + 1):
+                if child_col * TILE_SIZE >= prev_width:
+                    continue
+                children.append((child_col, child_row))
+        return children
+
+    def _render_tile(self, level, col, row):
+        level_width, level_height = self._levels[level]
+        x = col * TILE_SIZE
+        y = row * TILE_SIZE
+        width = min(TILE_SIZE, level_width - x)
+        height = min(TILE_SIZE, level_height - y)
+
+        tile = cairo.ImageSurface(self._surface.get_format(), width, height)
+        ctx = cairo.Context(tile)
+
+        if level == 1:
+            _paint_half(ctx, self._surface, 0, 0, width, height, -x, -y)
+            return tile
+
+        half_tile = TILE_SIZE // 2
+        for child_col, child_row in self._get_children(level, col, row):
+            child = self._tiles[(level - 1, child_col, child_row)]
+            child_x = (child_col - col * 2) * half_tile
+            child_y = (child_row - row * 2) * half_tile
+            _paint_half(ctx, child, child_x, child_y,
+                        min(width - child_x, (child.get_width() + 1) // 2),
+                        min(height - child_y, (child.get_height() + 1) // 2),
+                        child_x, child_y)
+
+        return tile
+
+    def _prepare_tiles(self, level, tiles):
+        # Render the missing tiles and the ones of the lower levels
+        # they are made from.  Each level is rendered in parallel,
+        # from the lowest one up.
+        missing = {level: [tile for tile in tiles
+                           if (level,) + tile not in self._tiles]}
+        for current in range(level, 1, -1):
+            children = set()
+            for col, row in missing[current]:
+                for child in self._get_children(current, col, row):
+                    if (current - 1,) + child not in self._tiles:
+                        children.add(child)
+            missing[current - 1] = sorted(children)
+
+        for current in range(1, level + 1):
+            keys = missing[current]
+            if len(keys) > 1 and WORKERS > 1:
+                rendered = _get_pool().map(
+                    lambda key: self._render_tile(current, *key), keys)
+            else:
+                rendered = [self._render_tile(current, *key) for key in keys]
+            for key, tile in zip(keys, rendered):
+                self._tiles[(current,) + key] = tile
+                self._tiles_size += tile.get_stride() * tile.get_height()
+
+    def _get_visible_tiles(self, matrix, box, level):
+        # Tiles of the level inside the box, in device pixels, for a
+        # context with the given matrix.
+        inverse = cairo.Matrix(matrix.xx, matrix.yx, matrix.xy, matrix.yy,
+                               matrix.x0, matrix.y0)
+        inverse.invert()
+        x, y, width, height = box
+        corners = [inverse.transform_point(corner_x, corner_y)
+                   for corner_x in (x, x + width)
+                   for corner_y in (y, y + height)]
+
+        factor = 2.0 ** level
+        level_width, level_height = self._levels[level]
+        first_col = max(0, int(min(c[0] for c in corners) / factor //
+                               TILE_SIZE))
+        first_row = max(0, int(min(c[1] for c in corners) / factor //
+                               TILE_SIZE))
+        last_col = min(int(math.ceil(max(c[0] for c in corners) / factor /
+                                     TILE_SIZE)),
+                       int(math.ceil(level_width * 1.0 / TILE_SIZE)))
+        last_row = min(int(math.ceil(max(c[1] for c in corners) / factor /
+                                     TILE_SIZE)),
+                       int(math.ceil(level_height * 1.0 / TILE_SIZE)))
+        return [(col, row) for row in range(first_row, last_row)
+                for col in range(first_col, last_col)]
+
+    def draw(self, ctx, scale, filter=cairo.FILTER_GOOD):
+        # The user space of the context must be in surface pixels,
+        # and scale is the size of one of those pixels on the
+        # screen.  Only the tiles inside the clip are painted.
+        level = self.get_level_for_scale(scale)
+        matrix = ctx.get_matrix()
+        box = _get_device_box(ctx)
+        if box[2] <= 0 or box[3] <= 0:
+            return
+
+        tiles = None
+        if level > 0:
+            tiles = self._get_visible_tiles(matrix, box, level)
+            self._prepare_tiles(level, tiles)
+
+        if filter not in PARALLEL_FILTERS or WORKERS < 2 or \
+                box[2] * box[3] < MIN_PARALLEL_AREA:
+            self._draw_level(ctx, level, tiles, filter)
+            return
+
+        # Draw each band in its own surface, then copy them in place.
+        x, y, width, height = box
+        count = max(1, min(WORKERS, height // MIN_BAND_HEIGHT))
+        band_height = int(math.ceil(height * 1.0 / count))
+        bands = [(x, band_y, width, min(band_height, y + height - band_y))
+                 for band_y in range(y, y + height, band_height)]
+        surfaces = _get_pool().map(
+            lambda band: self._render_band(matrix, band, level, tiles,
+                                           filter), bands)
+
+        ctx.save()
+        ctx.identity_matrix()
+        for band, surface in zip(bands, surfaces):
+            ctx.set_source_surface(surface, band[0], band[1])
+            ctx.rectangle(*band)
+            ctx.fill()
+        ctx.restore()
+
+    def _render_band(self, matrix, band, level, tiles, filter):
+        x, y, width, height = band
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        ctx = cairo.Context(surface)
+        ctx.translate(-x, -y)
+        ctx.transform(matrix)
+        self._draw_level(ctx, level, tiles, filter)
+        return surface
+
+    def _draw_level(self, ctx, level, tiles, filter):
+        if level == 0:
+            pattern = cairo.SurfacePattern(self._surface)
+            pattern.set_filter(filter)
+            ctx.rectangle(0, 0, self._surface.get_width(),
+                          self._surface.get_height())
+            _fill_pattern(ctx, pattern, self._gray)
+            return
+
+        factor = 2 ** level
+        ctx.save()
+        ctx.scale(factor, factor)
+
+        # Tiles share their borders, without antialiasing each
+        # screen pixel belongs to exactly one of them so no seams
+        # are visible.
+        ctx.set_antialias(cairo.ANTIALIAS_NONE)
+
+        for col, row in tiles:
+            tile = self._tiles[(level, col, row)]
+            pattern = cairo.SurfacePattern(tile)
+            pattern.set_matrix(cairo.Matrix(x0=-col * TILE_SIZE,
+                                            y0=-row * TILE_SIZE))
+            pattern.set_filter(filter)
+            pattern.set_extend(cairo.EXTEND_PAD)
+            ctx.rectangle(col * TILE_SIZE, row * TILE_SIZE,
+                          tile.get_width(), tile.get_height())
+            _fill_pattern(ctx, pattern, self._gray)
+
+        ctx.restore()
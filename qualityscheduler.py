@@ -0,0 +1,135 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import cairo
+
+from gi.repository import GLib
+
+# Render qualities, from the fastest to the best looking.  A quality
+# is an index in this list.  FILTER_FAST is left out, cairo draws it
+# like FILTER_NEAREST.
+FILTERS = [cairo.FILTER_NEAREST, cairo.FILTER_GOOD, cairo.FILTER_BEST]
+
+QUALITY_NEAREST = 0
+QUALITY_GOOD = 1
+QUALITY_BEST = len(FILTERS) - 1
+
+# Time to draw a frame while the view moves, in seconds.
+FRAME_BUDGET = 1 / 60.0
+
+# The view is settled once there was no input for this many frames,
+# or the minimum time, whichever is longer.
+SETTLE_FRAMES = 3
+SETTLE_MIN_TIME = 0.03
+
+# Weight of the last measure in the average cost of each quality.
+COST_WEIGHT = 0.3
+
+
+class QualityScheduler(object):
+    """
+    Pick the render quality of each frame.
+
+    The cost of drawing each pixel is measured for every quality.
+    While the view moves, the best quality known to fit in the frame
+    budget is used.  Once the input stops, the quality is raised one
+    step at a time in idle time, stopping as soon as new input
+    arrives.
+    """
+
+    def __init__(self, redraw_func):
+        self._redraw_func = redraw_func
+        self._costs = [None] * len(FILTERS)
+        self._last_frame_time = 0
+        self._quality = QUALITY_GOOD
+        self._in_motion = False
+        self._settle_hid = None
+        self._refine_hid = None
+
+    def get_quality(self):
+        return self._quality
+
+    def reset(self):
+        # A new image starts at a good quality and refines from
+        # there.
+        self._stop_timers()
+        self._in_motion = False
+        self._quality = QUALITY_GOOD
+
+    def _stop_timers(self):
+        if self._settle_hid is not None:
+            GLib.source_remove(self._settle_hid)
+            self._settle_hid = None
+        if self._refine_hid is not None:
+            GLib.source_remove(self._refine_hid)
+            self._refine_hid = None
+
+    def _pick_motion_quality(self, pixels):
+        # Use the best quality whose measured cost fits the budget.
+        # Qualities not measured yet are only tried once the view
+        # settles.
+        quality = QUALITY_NEAREST
+        for level, cost in enumerate(self._costs):
+            if cost is None or cost * pixels > FRAME_BUDGET:
+                break
+            quality = level
+        return quality
+
+    def start_input(self, pixels):
+        # Called for every input that moves or zooms the view, with
+        # the number of pixels of the view.
+        self._stop_timers()
+        self._in_motion = True
+        self._quality = self._pick_motion_quality(pixels)
+
+        delay = max(SETTLE_MIN_TIME, SETTLE_FRAMES * self._last_frame_time)
+        self._settle_hid = GLib.timeout_add(int(delay * 1000),
+                                            self.__settle_cb)
+
+    def __settle_cb(self):
+        self._settle_hid = None
+        self._in_motion = False
+        self._schedule_refine()
+        return False
+
+    def _schedule_refine(self):
+        if self._quality < QUALITY_BEST and self._refine_hid is None:
+            self._refine_hid = GLib.idle_add(self.__refine_cb,
+                                             priority=GLib.PRIORITY_LOW)
+
+    def __refine_cb(self):
+        self._refine_hid = None
+        if self._in_motion:
+            return False
+        self._quality += 1
+        self._redraw_func()
+        return False
+
+    def frame_drawn(self, quality, elapsed, pixels):
+        # Called after drawing a frame, with the quality used, the
+        # time it took in seconds and the number of pixels drawn.
+        self._last_frame_time = elapsed
+        if pixels > 0:
+            cost = elapsed / pixels
+            if self._costs[quality] is None:
+                self._costs[quality] = cost
+            else:
+                self._costs[quality] = cost * COST_WEIGHT + \
+                    self._costs[quality] * (1 - COST_WEIGHT)
+
+        # Refine the next stage once this one is on screen.
+        if not self._in_motion and self._settle_hid is None:
+            self._schedule_refine()
@@ -0,0 +1,417 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+'''
+Decoding of a region of images too big to be decoded in full.
+
+The image loaders always allocate the whole image, so the parts of
+the file covering the region are copied into a smaller image of the
+same format, which is then decoded as usual.  This works for tiled
+and stripped TIFF files, and for sequential JPEG files with restart
+markers.  The file is memory mapped, only the parts read are loaded.
+'''
+
+import logging
+import math
+import mmap
+import re
+import struct
+
+from gi.repository import GdkPixbuf
+
+import decoder
+
+# TIFF tags.
+IMAGE_WIDTH_TAG = 256
+IMAGE_LENGTH_TAG = 257
+STRIP_OFFSETS_TAG = 273
+ROWS_PER_STRIP_TAG = 278
+STRIP_BYTE_COUNTS_TAG = 279
+PLANAR_CONFIGURATION_TAG = 284
+TILE_WIDTH_TAG = 322
+TILE_LENGTH_TAG = 323
+TILE_OFFSETS_TAG = 324
+TILE_BYTE_COUNTS_TAG = 325
+
+# Tags pointing to other parts of the file, which are not copied.
+_POINTER_TAGS = (330, 34665, 34853, 40965)
+
+_SHORT = 3
+_LONG = 4
+
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4,
+               10: 8, 11: 4, 12: 8, 13: 4}
+
+# JPEG markers.
+_SOF_BASELINE = 0xc0
+_SOF_EXTENDED = 0xc1
+_DHT = 0xc4
+_DAC = 0xcc
+_SOS = 0xda
+_DRI = 0xdd
+_APP1 = 0xe1
+_COM = 0xfe
+
+# Restart markers and end of image, the only markers found in the
+# compressed data.
+_RESTART_RE = re.compile(b'\xff[\xd0-\xd7\xd9]')
+
+
+def _decode_pixbuf(data, width=None, height=None):
+    loader = GdkPixbuf.PixbufLoader()
+    if width is not None:
+        loader.set_size(width, height)
+    loader.write(data)
+    loader.close()
+    return loader.get_pixbuf()
+
+
+class _TiffSource(object):
+
+    def __init__(self, data):
+        self._data = data
+        if data[:2] == b'II':
+            self._endian = '<'
+        else:
+            self._endian = '>'
+
+        offset = struct.unpack_from(self._endian + 'I', data, 4)[0]
+        self._entries = self._read_entries(offset)
+
+        self._width = self._get_values(IMAGE_WIDTH_TAG)[0]
+        self._height = self._get_values(IMAGE_LENGTH_TAG)[0]
+
+        # Separate planes would need one chunk per plane.
+        if self._get_values(PLANAR_CONFIGURATION_TAG, [1])[0] != 1:
+            raise ValueError('Planar TIFF files are not supported')
+
+        if TILE_WIDTH_TAG in self._entries:
+            self._chunk_size = (self._get_values(TILE_WIDTH_TAG)[0],
+                                self._get_values(TILE_LENGTH_TAG)[0])
+            self._offsets_tag = TILE_OFFSETS_TAG
+            self._counts_tag = TILE_BYTE_COUNTS_TAG
+        else:
+            rows_per_strip = self._get_values(ROWS_PER_STRIP_TAG,
+                                              [self._height])[0]
+            self._chunk_size = (self._width, min(rows_per_strip,
+                                                 self._height))
+            self._offsets_tag = STRIP_OFFSETS_TAG
+            self._counts_tag = STRIP_BYTE_COUNTS_TAG
+
+        self._offsets = self._get_values(self._offsets_tag)
+        self._counts = self._get_values(self._counts_tag)
+
+        # A single strip is the whole image.
+        if len(self._offsets) < 2:
+            raise ValueError('TIFF file is not split in strips or tiles')
+
+    def _read_entries(self, offset):
+        # Map each tag to its type, count and raw value bytes.
+        entries = {}
+        count = struct.unpack_from(self._endian + 'H', self._data, offset)[0]
+        for i in range(count):
+            position = offset + 2 + i * 12
+            tag, value_type, value_count = struct.unpack_from(
+                self._endian + 'HHI', self._data, position)
+            size = _TYPE_SIZES.get(value_type, 1) * value_count
+            if size <= 4:
+                raw = self._data[position + 8:position + 8 + size]
+            else:
+                value_offset = struct.unpack_from(
+                    self._endian + 'I', self._data, position + 8)[0]
+                raw = self._data[value_offset:value_offset + size]
+            entries[tag] = (value_type, value_count, raw)
+        return entries
+
+    def _get_values(self, tag, default=None):
+        if tag not in self._entries:
+            if default is None:
+                raise ValueError('Missing TIFF tag %d' % tag)
+            return default
+        value_type, count, raw = self._entries[tag]
+        if value_type == _SHORT:
+            return struct.unpack(self._endian + '%dH' % count, raw)
+        return struct.unpack(self._endian + '%dI' % count, raw)
+
+    def _pack_longs(self, values):
+        return struct.pack(self._endian + '%dI' % len(values), *values)
+
+    def _get_chunks(self, rect):
+        # Columns and rows of the strips or tiles covering the rect.
+        x, y, width, height = rect
+        chunk_width, chunk_height = self._chunk_size
+        return (x // chunk_width,
+                int(math.ceil((x + width) * 1.0 / chunk_width)),
+                y // chunk_height,
+                int(math.ceil((y + height) * 1.0 / chunk_height)))
+
+    def get_band(self, rect):
+        # The rect actually decoded for the given one, whole strips
+        # or tiles.
+        first_col, last_col, first_row, last_row = self._get_chunks(rect)
+        chunk_width, chunk_height = self._chunk_size
+        band_x = first_col * chunk_width
+        band_y = first_row * chunk_height
+        return (band_x, band_y,
+                min((last_col - first_col) * chunk_width,
+                    self._width - band_x),
+                min((last_row - first_row) * chunk_height,
+                    self._height - band_y))
+
+    def get_decode_pixels(self, rect, scale):
+        # The band is decoded at full size, then reduced.
+        band = self.get_band(rect)
+        return band[2] * band[3]
+
+    def decode(self, job, rect, scale):
+        first_col, last_col, first_row, last_row = self._get_chunks(rect)
+        across = int(math.ceil(self._width * 1.0 / self._chunk_size[0]))
+
+        chunks = []
+        for row in range(first_row, last_row):
+            for col in range(first_col, last_col):
+                index = row * across + col
+                start = self._offsets[index]
+                chunks.append(self._data[start:start + self._counts[index]])
+
+        band = self.get_band(rect)
+        if job.is_cancelled():
+            return None
+        pixbuf = _decode_pixbuf(self._build(band[2], band[3], chunks))
+        if scale < 1:
+            pixbuf = pixbuf.scale_simple(
+                max(1, int(math.ceil(band[2] * scale))),
+                max(1, int(math.ceil(band[3] * scale))),
+                GdkPixbuf.InterpType.BILINEAR)
+        return (band, decoder.surface_from_pixbuf(pixbuf))
+
+    def _build(self, width, height, chunks):
+        # Write a TIFF file with the given strips or tiles and the tags
+        # of the original one.
+        entries = dict((tag, entry) for tag, entry in self._entries.items()
+                       if tag not in _POINTER_TAGS)
+        entries[IMAGE_WIDTH_TAG] = (_LONG, 1, self._pack_longs([width]))
+        entries[IMAGE_LENGTH_TAG] = (_LONG, 1, self._pack_longs([height]))
+        entries[self._counts_tag] = (
+            _LONG, len(chunks), self._pack_longs([len(c) for c in chunks]))
+        entries[self._offsets_tag] = (
+            _LONG, len(chunks), self._pack_longs([0] * len(chunks)))
+        tags = sorted(entries)
+
+        # Values that don't fit in their entry go after the directory,
+        # then the image data.
+        position = 8 + 2 + len(tags) * 12 + 4
+        value_offsets = {}
+        for tag in tags:
+            raw = entries[tag][2]
+            if len(raw) > 4:
+                value_offsets[tag] = position
+                position += len(raw) + len(raw) % 2
+
+        chunk_offsets = []
+        for chunk in chunks:
+            chunk_offsets.append(position)
+            position += len(chunk)
+        entries[self._offsets_tag] = (_LONG, len(chunks),
+                                      self._pack_longs(chunk_offsets))
+
+        endian = self._endian
+        output = bytearray(self._data[:2])
+        output += struct.pack(endian + 'HIH', 42, 8, len(tags))
+        for tag in tags:
+            value_type, count, raw = entries[tag]
+            output += struct.pack(endian + 'HHI', tag, value_type, count)
+            if tag in value_offsets:
+                output += struct.pack(endian + 'I', value_offsets[tag])
+            else:
+                output += raw.ljust(4, b'\x00')
+        output += struct.pack(endian + 'I', 0)
+
+        for tag in tags:
+            if tag in value_offsets:
+                raw = entries[tag][2]
+                output += raw
+                if len(raw) % 2:
+                    output += b'\x00'
+        for chunk in chunks:
+            output += chunk
+        return bytes(output)
+
+
+class _JpegSource(object):
+
+    def __init__(self, data):
+        self._data = data
+        self._tables = []
+        self._frame = None
+        self._scan = None
+        self._restart_interval = 0
+
+        position = 2
+        while True:
+            if data[position] != 0xff:
+                raise ValueError('Invalid JPEG marker')
+            marker = data[position + 1]
+            if marker == 0xff:
+                position += 1
+                continue
+
+            length = struct.unpack_from('>H', data, position + 2)[0]
+            segment = data[position:position + 2 + length]
+            position += 2 + length
+
+            if marker in (_SOF_BASELINE, _SOF_EXTENDED):
+                self._frame = segment
+            elif 0xc0 <= marker <= 0xcf and marker not in (_DHT, _DAC):
+                raise ValueError('Only sequential JPEG files are supported')
+            elif marker == _DRI:
+                self._restart_interval = struct.unpack_from(
+                    '>H', segment, 4)[0]
+            elif marker == _SOS:
+                self._scan = segment
+                break
+            elif marker not in (_APP1, _COM):
+                # Quantization and Huffman tables, and the headers
+                # telling the color space.
+                self._tables.append(segment)
+
+        if self._frame is None:
+            raise ValueError('Missing JPEG frame header')
+        if self._restart_interval == 0:
+            raise ValueError('JPEG file without restart markers')
+
+        self._height, self._width, components = struct.unpack_from(
+            '>HHB', self._frame, 5)
+        if components == 1:
+            self._mcu_size = (8, 8)
+        else:
+            sampling = [self._frame[11 + i * 3] for i in range(components)]
+            self._mcu_size = (max(s >> 4 for s in sampling) * 8,
+                              max(s & 0xf for s in sampling) * 8)
+        if self._scan[4] != components:
+            raise ValueError('JPEG file with several scans')
+
+        mcus_across = int(math.ceil(self._width * 1.0 / self._mcu_size[0]))
+        mcus_down = int(math.ceil(self._height * 1.0 / self._mcu_size[1]))
+        if mcus_across % self._restart_interval != 0:
+            raise ValueError('JPEG restart intervals span several rows')
+        self._segments_across = mcus_across // self._restart_interval
+
+        # Index the compressed data between restart markers, each
+        # piece can be decoded on its own.
+        self._starts = [position]
+        self._ends = []
+        for match in _RESTART_RE.finditer(data, position):
+            self._ends.append(match.start())
+            if data[match.start() + 1] == 0xd9:
+                break
+            self._starts.append(match.end())
+
+        expected = mcus_across * mcus_down // self._restart_interval
+        if len(self._ends) != len(self._starts) or \
+                len(self._starts) != expected:
+            raise ValueError('Unexpected number of JPEG restart intervals')
+
+    def _get_segments(self, rect):
+        # Columns of restart intervals and rows of MCUs covering the
+        # rect.
+        x, y, width, height = rect
+        segment_width = self._restart_interval * self._mcu_size[0]
+        mcu_height = self._mcu_size[1]
+        return (x // segment_width,
+                int(math.ceil((x + width) * 1.0 / segment_width)),
+                y // mcu_height,
+                int(math.ceil((y + height) * 1.0 / mcu_height)))
+
+    def get_band(self, rect):
+        # The rect actually decoded for the given one, whole restart
+        # intervals, which may span the width of the image.
+        first_col, last_col, first_row, last_row = self._get_segments(rect)
+        segment_width = self._restart_interval * self._mcu_size[0]
+        mcu_height = self._mcu_size[1]
+        band_x = first_col * segment_width
+        band_y = first_row * mcu_height
+        return (band_x, band_y,
+                min((last_col - first_col) * segment_width,
+                    self._width - band_x),
+                min((last_row - first_row) * mcu_height,
+                    self._height - band_y))
+
+    def get_decode_pixels(self, rect, scale):
+        # The loader decodes JPEG files straight at a reduced size.
+        band = self.get_band(rect)
+        return band[2] * band[3] * min(scale, 1.0) ** 2
+
+    def decode(self, job, rect, scale):
+        first_col, last_col, first_row, last_row = self._get_segments(rect)
+        band = self.get_band(rect)
+
+        output = bytearray(b'\xff\xd8')
+        for table in self._tables:
+            output += table
+        output += self._frame[:5] + struct.pack('>HH', band[3], band[2]) + \
+            self._frame[9:]
+        output += struct.pack('>HHH', 0xffdd, 4, self._restart_interval)
+        output += self._scan
+
+        # Restart markers are numbered from 0 to 7 in sequence.
+        count = 0
+        for row in range(first_row, last_row):
+            for col in range(first_col, last_col):
+                index = row * self._segments_across + col
+                if count > 0:
+                    output += bytes((0xff, 0xd0 + (count - 1) % 8))
+                output += self._data[self._starts[index]:self._ends[index]]
+                count += 1
+        output += b'\xff\xd9'
+
+        if job.is_cancelled():
+            return None
+        width = None
+        height = None
+        if scale < 1:
+            width = max(1, int(math.ceil(band[2] * scale)))
+            height = max(1, int(math.ceil(band[3] * scale)))
+        pixbuf = _decode_pixbuf(bytes(output), width, height)
+        return (band, decoder.surface_from_pixbuf(pixbuf))
+
+
+def open_region_source(job, file_location):
+    # Return an object able to decode regions of the image, or None
+    # if the format or the layout of the file does not allow it.
+    with open(file_location, 'rb') as image_file:
+        try:
+            data = mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error):
+            return None
+
+    try:
+        if data[:4] in (b'II*\x00', b'MM\x00*'):
+            return _TiffSource(data)
+        if data[:2] == b'\xff\xd8':
+            return _JpegSource(data)
+    except (ValueError, IndexError, struct.error) as error:
+        logging.debug('Regions of %s can not be decoded: %s',
+                      file_location, error)
+    return None
+
+
+def decode_region(job, source, rect, scale):
+    # Decode at least the rect of the image, in full size image
+    # coordinates, at the given scale.  Return the rect actually
+    # decoded, aligned to the strips or tiles of the file, and its
+    # surface.
+    return source.decode(job, rect, scale)
@@ -0,0 +1,319 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import cairo
+import collections
+import contextlib
+import fcntl
+import hashlib
+import itertools
+import json
+import logging
+import os
+import struct
+import threading
+import time
+
+import tempfiles
+
+# Bytes of disk the cache may use.
+MAX_SIZE = 128 * 1024 * 1024
+
+# Bigger renditions are not stored, decoding them again is better
+# than filling the cache with a few of them.
+MAX_RENDITION_PIXELS = 1920 * 1200
+
+# Seconds between saves of the index, stored renditions and the order
+# they were used in are saved in batches.
+SAVE_INTERVAL = 30
+
+# Seconds before a rendition missing from the index is taken for one
+# left by a crash.  Younger ones may belong to an instance that didn't
+# save its index yet.
+ORPHAN_AGE = 24 * 60 * 60
+
+INDEX_NAME = 'index.json'
+LOCK_NAME = 'index.lock'
+RENDITION_SUFFIX = '.surface'
+TEMP_SUFFIX = '.tmp'
+
+# Magic, cairo format, width, height and stride of the pixels that
+# follow.
+_HEADER = struct.Struct('<4siiii')
+_MAGIC = b'IVR1'
+
+
+def get_key(object_id, file_location):
+    # Journal objects keep their object id when their file changes,
+    # the size and modification time tell versions apart.
+    try:
+        stat = os.stat(file_location)
+    except OSError:
+        return None
+    return '%s-%d-%d' % (object_id, stat.st_size, stat.st_mtime_ns)
+
+
+class RenditionCache(object):
+    """
+    Decoded images stored on disk, several sizes for each image, so
+    they are loaded back without decoding the file again, even in
+    later sessions.
+
+    Renditions are raw surface pixels, loading them is a plain read.
+    Each one is written to a temporary file and renamed in place, and
+    so is the index, which keeps the renditions in least recently
+    used order.  The oldest ones are removed when the cache is full.
+
+    The directory is shared by all the running instances of the
+    activity.  The index is saved under a file lock, merged with the
+    renditions the other instances stored or removed, and temporary
+    files are named after the process and thread writing them.  Stored
+    renditions and the order they are used in are saved from time to
+    time and by flush().  Old files not in the index, left by a crash,
+    are removed on start.
+
+    All methods can be called from any thread.
+    """
+
+    def __init__(self, directory, max_size=MAX_SIZE):
+        self._directory = directory
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+
+        # Renditions by name, with their key, size and the time they
+        # were last used, in that order.  Removed ones are kept out of
+        # the index of the other instances on the next save.
+        self._entries = collections.OrderedDict()
+        self._removed = set()
+        self._size = 0
+        self._changed = False
+        self._saved = time.time()
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as error:
+            logging.error('Can not create the rendition cache: %s', error)
+            return
+
+        with self._lock:
+            try:
+                with self._lock_index():
+                    self._merge_index()
+                    self._remove_orphans()
+            except (IOError, OSError) as error:
+                logging.error('Can not load the rendition cache: %s', error)
+
+    def _get_path(self, name):
+        return os.path.join(self._directory, name)
+
+    def _get_temp_path(self, path):
+        return '%s.%d-%d-%d%s' % (path, os.getpid(), threading.get_ident(),
+                                  next(self._counter), TEMP_SUFFIX)
+
+    @contextlib.contextmanager
+    def _lock_index(self):
+        # Keep the other instances off the index and the renditions.
+        with open(self._get_path(LOCK_NAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _merge_index(self):
+        # Add the renditions the other instances stored, and drop the
+        # ones whose file is gone.  Called with the index locked.
+        try:
+            with open(self._get_path(INDEX_NAME)) as index_file:
+                index = json.load(index_file)
+        except (IOError, OSError, ValueError):
+            index = []
+
+        for item in index:
+            try:
+                name, key, width, height, size, used = item
+            except (TypeError, ValueError):
+                continue
+            if name in self._removed:
+                continue
+            entry = self._entries.get(name)
+            if entry is None or entry[4] < used:
+                self._entries[name] = (key, width, height, size, used)
+
+        entries = [(name, entry) for name, entry in self._entries.items()
+                   if os.path.exists(self._get_path(name))]
+        entries.sort(key=lambda item: item[1][4])
+        self._entries = collections.OrderedDict(entries)
+        self._size = sum(entry[3] for entry in self._entries.values())
+
+    def _evict(self, keep=None):
+        # Remove the oldest renditions but the one to keep while the
+        # cache is too big.
+        if self._size <= self._max_size:
+            return
+        for name in list(self._entries.keys()):
+            if self._size <= self._max_size:
+                break
+            if name != keep:
+                self._remove(name)
+
+    def _save_index(self):
+        # Merge the index, evict and write it.  Called with the index
+        # locked.
+        self._merge_index()
+        self._evict()
+
+        index = [[name] + list(entry) for name, entry in self._entries.items()]
+        path = self._get_path(INDEX_NAME)
+        temp_path = self._get_temp_path(path)
+        with open(temp_path, 'w') as index_file:
+            json.dump(index, index_file)
+        os.replace(temp_path, path)
+
+        self._removed.clear()
+        self._changed = False
+        self._saved = time.time()
+
+    def _save(self):
+        try:
+            with self._lock_index():
+                self._save_index()
+        except (IOError, OSError) as error:
+            logging.error('Can not save the rendition cache: %s', error)
+
+    def _remove_orphans(self):
+        # Called with the index locked and merged.
+        now = time.time()
+        for name in os.listdir(self._directory):
+            if name in (INDEX_NAME, LOCK_NAME) or name in self._entries:
+                continue
+            path = self._get_path(name)
+
+            # Temporary files of running instances are being written.
+            if name.endswith(TEMP_SUFFIX):
+                owner = name[:-len(TEMP_SUFFIX)].rsplit('.', 1)[-1]
+                pid = owner.split('-')[0]
+                if pid.isdigit() and tempfiles.is_running(int(pid)):
+                    continue
+            else:
+                try:
+                    if now - os.path.getmtime(path) < ORPHAN_AGE:
+                        continue
+                except OSError:
+                    continue
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _remove(self, name):
+        key, width, height, size, used = self._entries.pop(name)
+        self._size -= size
+        self._removed.add(name)
+        try:
+            os.unlink(self._get_path(name))
+        except OSError:
+            pass
+
+    def flush(self):
+        # Save the order the renditions were used in, called from time
+        # to time while loading and when the activity closes.
+        with self._lock:
+            if self._changed:
+                self._save()
+
+    def load(self, key, width, height):
+        # Return the smallest rendition of the image at least as big
+        # as the given size, or None.
+        if key is None:
+            return None
+
+        with self._lock:
+            found = None
+            for name, entry in self._entries.items():
+                if entry[0] == key and entry[1] >= width and \
+                        entry[2] >= height and \
+                        (found is None or entry[1] < found[1][1]):
+                    found = (name, entry)
+            if found is None:
+                return None
+            self._entries[found[0]] = found[1][:4] + (time.time(),)
+            self._entries.move_to_end(found[0])
+            self._changed = True
+
+        try:
+            with open(self._get_path(found[0]), 'rb') as rendition:
+                magic, surface_format, width, height, stride = \
+                    _HEADER.unpack(rendition.read(_HEADER.size))
+                data = bytearray(rendition.read())
+            if magic != _MAGIC or len(data) != stride * height:
+                raise ValueError('Invalid rendition')
+            surface = cairo.ImageSurface.create_for_data(
+                data, surface_format, width, height, stride)
+        except (IOError, OSError, ValueError, struct.error) as error:
+            logging.warning('Dropping rendition %s: %s', found[0], error)
+            with self._lock:
+                if found[0] in self._entries:
+                    self._remove(found[0])
+                    self._changed = True
+            return None
+
+        if time.time() - self._saved > SAVE_INTERVAL:
+            self.flush()
+        return surface
+
+    def store(self, key, surface):
+        if key is None:
+            return
+        width = surface.get_width()
+        height = surface.get_height()
+        if width * height > MAX_RENDITION_PIXELS:
+            return
+
+        name = hashlib.sha1(('%s-%dx%d' % (key, width, height)).encode(
+            'utf-8')).hexdigest() + RENDITION_SUFFIX
+        path = self._get_path(name)
+        temp_path = self._get_temp_path(path)
+
+        surface.flush()
+        header = _HEADER.pack(_MAGIC, int(surface.get_format()), width,
+                              height, surface.get_stride())
+        try:
+            with open(temp_path, 'wb') as rendition:
+                rendition.write(header)
+                rendition.write(surface.get_data())
+        except (IOError, OSError) as error:
+            logging.warning('Can not store rendition: %s', error)
+            return
+
+        # Only the rendition is written now, the index is saved with
+        # the next batch.
+        size = _HEADER.size + surface.get_stride() * height
+        with self._lock:
+            try:
+                os.replace(temp_path, path)
+            except OSError as error:
+                logging.warning('Can not store rendition: %s', error)
+                return
+            self._removed.discard(name)
+            entry = self._entries.pop(name, None)
+            if entry is not None:
+                self._size -= entry[3]
+            self._entries[name] = (key, width, height, size, time.time())
+            self._size += size
+            self._changed = True
+            self._evict(name)
+
+        if time.time() - self._saved > SAVE_INTERVAL:
+            self.flush()
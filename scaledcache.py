@@ -0,0 +1,161 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import cairo
+import math
+
+# Extra area rendered around the visible one, as a fraction of the
+# view size on each side.
+MARGIN = 0.5
+
+
+def _subtract(rect, other):
+    # Return the parts of the rectangle not covered by the other one,
+    # as a list of up to four rectangles.
+    x, y, width, height = rect
+    x1 = max(x, other[0])
+    y1 = max(y, other[1])
+    x2 = min(x + width, other[0] + other[2])
+    y2 = min(y + height, other[1] + other[3])
+    if x2 <= x1 or y2 <= y1:
+        return [rect]
+
+    strips = []
+    if y1 > y:
+        strips.append((x, y, width, y1 - y))
+    if y2 < y + height:
+        strips.append((x, y2, width, y + height - y2))
+    if x1 > x:
+        strips.append((x, y1, x1 - x, y2 - y1))
+    if x2 < x + width:
+        strips.append((x2, y1, x + width - x2, y2 - y1))
+    return strips
+
+
+class ScaledCache(object):
+    """
+    The image already rendered at the current zoom, covering the
+    visible area and a margin around it.
+
+    While the zoom and rotation stay the same, drawing is a plain
+    copy from the cache without any scaling.  The render function is
+    called with a context whose user space is the scaled image, with
+    its top left corner at the origin, the zoom and the render
+    quality.  It must only paint inside the clip of the context.
+
+    The cache is used as long as it was rendered with at least the
+    requested quality, otherwise it is rendered again.
+
+    When scrolling moves the visible area out of the cache, the part
+    still inside is shifted and only the newly exposed strips are
+    rendered.
+    """
+
+    def __init__(self, render_func):
+        self._render_func = render_func
+        self._surface = None
+        self._key = None
+        self._rect = None
+        self._quality = None
+
+    def invalidate(self):
+        self._surface = None
+        self._key = None
+        self._rect = None
+        self._quality = None
+
+    def get_size(self):
+        if self._surface is None:
+            return 0
+        return self._surface.get_stride() * self._surface.get_height()
+
+    def _contains(self, rect):
+        x, y, width, height = rect
+        cache_x, cache_y, cache_width, cache_height = self._rect
+        return x >= cache_x and y >= cache_y and \
+            x + width <= cache_x + cache_width and \
+            y + height <= cache_y + cache_height
+
+    def _render(self, key, rect, zoom, quality):
+        x, y, width, height = rect
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        ctx = cairo.Context(surface)
+
+        strips = [rect]
+        if self._surface is not None and key == self._key and \
+                self._quality >= quality:
+            ctx.set_source_surface(self._surface,
+                                   self._rect[0] - x, self._rect[1] - y)
+            ctx.paint()
+            strips = _subtract(rect, self._rect)
+            quality = min(quality, self._quality)
+
+        ctx.translate(-x, -y)
+        for strip in strips:
+            ctx.save()
+            ctx.rectangle(*strip)
+            ctx.clip()
+            self._render_func(ctx, zoom, quality)
+            ctx.restore()
+
+        self._surface = surface
+        self._key = key
+        self._rect = rect
+        self._quality = quality
+
+    def draw(self, ctx, key, zoom, origin, view_size, image_size, quality):
+        # The origin is the position of the top left corner of the
+        # image in the view.  It is rounded to whole pixels so the
+        # copy does not need any filtering.
+        origin_x = int(round(origin[0]))
+        origin_y = int(round(origin[1]))
+        scaled_width = int(math.ceil(image_size[0] * zoom))
+        scaled_height = int(math.ceil(image_size[1] * zoom))
+
+        # Part of the scaled image that needs to be painted, only the
+        # damaged area of the view is inside the clip.
+        clip_x1, clip_y1, clip_x2, clip_y2 = ctx.clip_extents()
+        x1 = max(0, int(math.floor(clip_x1)) - origin_x)
+        y1 = max(0, int(math.floor(clip_y1)) - origin_y)
+        x2 = min(scaled_width, int(math.ceil(clip_x2)) - origin_x)
+        y2 = min(scaled_height, int(math.ceil(clip_y2)) - origin_y)
+        if x2 <= x1 or y2 <= y1:
+            return
+        damaged = (x1, y1, x2 - x1, y2 - y1)
+
+        if self._surface is None or key != self._key or \
+                self._quality < quality or not self._contains(damaged):
+            # Cover the whole view and the margin, not just the
+            # damaged area.
+            x1 = min(x1, max(0, -origin_x))
+            y1 = min(y1, max(0, -origin_y))
+            x2 = max(x2, min(scaled_width, view_size[0] - origin_x))
+            y2 = max(y2, min(scaled_height, view_size[1] - origin_y))
+
+            margin_x = int(view_size[0] * MARGIN)
+            margin_y = int(view_size[1] * MARGIN)
+            x1 = max(0, x1 - margin_x)
+            y1 = max(0, y1 - margin_y)
+            x2 = min(scaled_width, x2 + margin_x)
+            y2 = min(scaled_height, y2 + margin_y)
+            self._render(key, (x1, y1, x2 - x1, y2 - y1), zoom, quality)
+
+        ctx.set_source_surface(self._surface,
+                               origin_x + self._rect[0],
+                               origin_y + self._rect[1])
+        ctx.rectangle(origin_x + damaged[0], origin_y + damaged[1],
+                      damaged[2], damaged[3])
+        ctx.fill()
@@ -0,0 +1,317 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import functools
+import logging
+
+from gi.repository import Gdk
+from gi.repository import GLib
+from gi.repository import Gtk
+
+import decoder
+import memorybudget
+import renditioncache
+import ImageView
+
+# Seconds each image stays on screen, and the cross fade to the next
+# one takes.
+SLIDE_TIME = 5.0
+TRANSITION_TIME = 0.6
+
+# Images decoded ahead of the one on screen.
+AHEAD = 3
+
+
+class Slideshow(Gtk.DrawingArea):
+    """
+    Show the journal images one after the other, looping.
+
+    The next images are decoded in the background, already scaled to
+    the screen, well before their turn, so changing image is only a
+    cross fade driven by the frame clock.  Between cross fades nothing
+    runs but a timeout for the end of the slide time.  If an image is
+    not decoded when its turn comes, the current one stays on screen
+    and the overrun is logged with how late the image was.
+    """
+
+    def __init__(self, image_list, rendition_cache=None):
+        Gtk.DrawingArea.__init__(self)
+
+        self._image_list = image_list
+        self._rendition_cache = rendition_cache
+
+        # Slides by object id, None for images that could not be
+        # decoded.
+        self._slides = {}
+        self._jobs = {}
+
+        self._running = False
+        self._start_index = None
+        self._object_id = None
+        self._next_id = None
+        self._slide_pending = False
+        self._waiting = False
+        self._transition_start = None
+        self._overrun_start = None
+        self._overruns = 0
+        self._timeout_id = None
+        self._tick_id = None
+
+        self._budget = memorybudget.get_memory_budget()
+        self._budget_key = ('slideshow', id(self))
+
+        self.connect('draw', self.__draw_cb)
+
+    def start(self, index):
+        self._running = True
+        self._start_index = index
+        self._begin()
+
+    def _begin(self):
+        # The first image may be in a page not loaded yet, refresh()
+        # tries again once pages are loaded.
+        count = len(self._image_list)
+        if count == 0:
+            return
+        index = min(self._start_index, count - 1)
+        jobject = self._image_list[index]
+        if jobject is None:
+            self._image_list.load_around(index)
+            return
+
+        self._start_index = None
+        self._object_id = jobject.object_id
+        self._fill_pipeline()
+        self._schedule_slide()
+
+    def stop(self):
+        # Return the object id of the image on screen.
+        self._running = False
+        if self._timeout_id is not None:
+            GLib.source_remove(self._timeout_id)
+            self._timeout_id = None
+        if self._tick_id is not None:
+            self.remove_tick_callback(self._tick_id)
+            self._tick_id = None
+        for object_id in list(self._jobs.keys()):
+            self._cancel(object_id)
+        self._next_id = None
+        self._transition_start = None
+        self._slide_pending = False
+        self._waiting = False
+        self._slides = {}
+        self._budget.remove(self._budget_key)
+        if self._overruns:
+            logging.warning('Slideshow decoding fell behind %d times',
+                            self._overruns)
+        return self._object_id
+
+    def refresh(self):
+        # Called when the images changed, like when a page of them was
+        # loaded.
+        if not self._running:
+            return
+        if self._start_index is not None:
+            self._begin()
+            return
+        self._fill_pipeline()
+        if self._waiting:
+            self._advance()
+
+    def _get_slide_size(self):
+        alloc = self.get_allocation()
+        if alloc.width <= 1 or alloc.height <= 1:
+            return (Gdk.Screen.width(), Gdk.Screen.height())
+        return (alloc.width, alloc.height)
+
+    def _get_following(self):
+        # Object ids of the images after the one on screen, wrapping
+        # around, skipping the ones that could not be decoded.  None
+        # stands for an image whose page is not loaded yet.
+        count = len(self._image_list)
+        index = self._image_list.find(self._object_id)
+        following = []
+        if index is None or count < 2:
+            return following
+
+        for step in range(1, count):
+            position = (index + step) % count
+            jobject = self._image_list[position]
+            if jobject is None:
+                self._image_list.load_around(position)
+                following.append(None)
+            elif jobject.object_id in self._slides and \
+                    self._slides[jobject.object_id] is None:
+                continue
+            else:
+                following.append(jobject.object_id)
+            if len(following) == AHEAD:
+                break
+        return following
+
+    def _fill_pipeline(self):
+        # Keep the image on screen and the next ones decoded, in
+        # order, and forget the others.
+        wanted = [self._object_id] + self._get_following()
+        if self._next_id is not None:
+            wanted.append(self._next_id)
+
+        for object_id in list(self._jobs.keys()):
+            if object_id not in wanted:
+                self._cancel(object_id)
+        for object_id in list(self._slides.keys()):
+            if object_id not in wanted and self._slides[object_id] is not None:
+                del self._slides[object_id]
+
+        for object_id in wanted:
+            if object_id is None or object_id in self._slides or \
+                    object_id in self._jobs:
+                continue
+            file_path = self._image_list.request_file_path(
+                object_id, self.__file_path_cb)
+            if file_path is None:
+                continue
+
+            priority = decoder.PRIORITY_PREFETCH
+            if object_id == self._object_id:
+                priority = decoder.PRIORITY_VISIBLE
+            self._jobs[object_id] = decoder.get_decode_queue().submit(
+                priority, ImageView.prepare_fitted,
+                functools.partial(self.__slide_decoded_cb, object_id),
+                file_path, self._get_slide_size(), self._rendition_cache,
+                renditioncache.get_key(object_id, file_path))
+        self._update_budget()
+
+    def _cancel(self, object_id):
+        self._jobs.pop(object_id).cancel()
+        self._image_list.release_file_path(object_id)
+
+    def __file_path_cb(self, object_id, file_path):
+        # Images without a file are skipped like the ones that could
+        # not be decoded.  The others are submitted in order, asking
+        # for their files again.
+        if file_path is None:
+            if self._running:
+                self._slides[object_id] = None
+                self._fill_pipeline()
+            return
+        if self._running:
+            self._fill_pipeline()
+        self._image_list.release_file_path(object_id)
+
+    def _update_budget(self):
+        size = 0
+        for surface in self._slides.values():
+            if surface is not None:
+                size += memorybudget.get_surface_size(surface)
+        self._budget.add(self._budget_key, size)
+
+    def __slide_decoded_cb(self, object_id, surface):
+        self._jobs.pop(object_id, None)
+        self._image_list.release_file_path(object_id)
+        self._slides[object_id] = surface
+        if surface is None:
+            # Skip the image, decode the one after instead.
+            self._fill_pipeline()
+        self._update_budget()
+        if object_id == self._object_id:
+            self.queue_draw()
+            if self._slide_pending:
+                self._schedule_slide()
+        elif self._waiting:
+            self._advance()
+
+    def _schedule_slide(self):
+        # The time of an image starts once it is shown, an image that
+        # could not be decoded is passed at once.
+        if self._object_id not in self._slides:
+            self._slide_pending = True
+            return
+        self._slide_pending = False
+        if self._slides[self._object_id] is None:
+            self._advance()
+        else:
+            self._timeout_id = GLib.timeout_add(int(SLIDE_TIME * 1000),
+                                                self.__slide_timeout_cb)
+
+    def __slide_timeout_cb(self):
+        self._timeout_id = None
+        self._advance()
+        return False
+
+    def _advance(self):
+        # Cross fade to the next image, or wait for it to be decoded.
+        following = self._get_following()
+        next_id = following[0] if following else None
+        if next_id is None or self._slides.get(next_id) is None:
+            self._waiting = True
+            if following and self._overrun_start is None:
+                self._overrun_start = GLib.get_monotonic_time()
+                self._overruns += 1
+            return
+
+        self._waiting = False
+        if self._overrun_start is not None:
+            logging.warning('Slideshow image decoded %.2f s late',
+                            (GLib.get_monotonic_time() -
+                             self._overrun_start) / 1000000.0)
+            self._overrun_start = None
+        self._next_id = next_id
+        self._tick_id = self.add_tick_callback(self.__tick_cb)
+
+    def __tick_cb(self, widget, frame_clock):
+        now = frame_clock.get_frame_time() / 1000000.0
+        if self._transition_start is None:
+            self._transition_start = now
+        self.queue_draw()
+        if now - self._transition_start < TRANSITION_TIME:
+            return True
+
+        self._object_id = self._next_id
+        self._next_id = None
+        self._transition_start = None
+        self._tick_id = None
+        self._fill_pipeline()
+        self._schedule_slide()
+        return False
+
+    def _paint_slide(self, ctx, surface, alpha):
+        alloc = self.get_allocation()
+        width = surface.get_width()
+        height = surface.get_height()
+        scale = min(alloc.width * 1.0 / width, alloc.height * 1.0 / height)
+
+        ctx.save()
+        ctx.translate((alloc.width - width * scale) / 2,
+                      (alloc.height - height * scale) / 2)
+        ctx.scale(scale, scale)
+        ctx.set_source_surface(surface, 0, 0)
+        ctx.paint_with_alpha(alpha)
+        ctx.restore()
+
+    def __draw_cb(self, widget, ctx):
+        ctx.set_source_rgb(0, 0, 0)
+        ctx.paint()
+
+        surface = self._slides.get(self._object_id)
+        if surface is not None:
+            self._paint_slide(ctx, surface, 1)
+
+        if self._transition_start is not None:
+            frame_time = self.get_frame_clock().get_frame_time() / 1000000.0
+            progress = min(1.0, (frame_time - self._transition_start) /
+                           TRANSITION_TIME)
+            self._paint_slide(ctx, self._slides[self._next_id], progress)
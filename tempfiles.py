@@ -0,0 +1,110 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import logging
+import os
+
+PREFIX = 'tmp'
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class TempFileManager(object):
+    """
+    Links to files the activity keeps using after the one it was given
+    goes away, like the file of the journal object being read.
+
+    Each file is linked once, however many times it is acquired, and
+    the link is removed when the last user releases it.  Releasing a
+    path that was not acquired does nothing, so files the activity
+    doesn't own can be passed around the same way.
+
+    The instance directory is shared by all the running instances of
+    the activity, the links are named after the process that made
+    them.  Links left by instances that are not running anymore are
+    removed on start.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._prefix = '%s-%d-' % (PREFIX, os.getpid())
+        self._counter = 0
+
+        # Links by the path they link to, and their reference counts.
+        self._links = {}
+        self._references = {}
+
+        self._remove_orphans()
+
+    def _remove_orphans(self):
+        try:
+            names = os.listdir(self._directory)
+        except OSError:
+            return
+
+        for name in names:
+            if not name.startswith(PREFIX):
+                continue
+
+            # Links named tmp-<pid>-<number> belong to a process,
+            # older ones, named after the time, to none.
+            parts = name.split('-')
+            if len(parts) == 3 and parts[1].isdigit() and \
+                    is_running(int(parts[1])):
+                continue
+            try:
+                os.unlink(os.path.join(self._directory, name))
+            except OSError as error:
+                logging.warning('Can not remove %s: %s', name, error)
+
+    def acquire(self, file_path):
+        # Return a path to the file that stays valid until released.
+        link = self._links.get(file_path)
+        if link is None:
+            self._counter += 1
+            link = os.path.join(self._directory,
+                                '%s%d' % (self._prefix, self._counter))
+            os.link(file_path, link)
+            self._links[file_path] = link
+            self._references[link] = 0
+
+        self._references[link] += 1
+        return link
+
+    def release(self, path):
+        if path not in self._references:
+            return
+
+        self._references[path] -= 1
+        if self._references[path] > 0:
+            return
+
+        del self._references[path]
+        for file_path, link in list(self._links.items()):
+            if link == path:
+                del self._links[file_path]
+        try:
+            os.unlink(path)
+        except OSError as error:
+            logging.warning('Can not remove %s: %s', path, error)
@@ -0,0 +1,328 @@
+# Copyright (C) 2026, Sugar Labs
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import collections
+import functools
+
+from gi.repository import Gdk
+from gi.repository import GObject
+from gi.repository import Gtk
+
+import decoder
+import memorybudget
+import renditioncache
+import ImageView
+
+CELL_SIZE = 160
+CELL_PADDING = 8
+THUMBNAIL_SIZE = CELL_SIZE - 2 * CELL_PADDING
+
+# Thumbnails kept in memory, the least recently shown are dropped
+# first.  Scrolling back to them loads them from the rendition cache.
+MAX_THUMBNAILS = 300
+
+
+class ThumbnailGrid(Gtk.DrawingArea, Gtk.Scrollable):
+    """
+    Thumbnails of the journal images in a grid, to pick the one to
+    view.
+
+    Only the visible cells are drawn, there is no widget per image,
+    so the grid costs the same for any number of images.  The
+    thumbnails of the visible cells are decoded by the thumbnail
+    threads in the order the cells are drawn, and the decoding is
+    cancelled for cells scrolled out of view.
+    """
+
+    __gtype_name__ = 'ThumbnailGrid'
+
+    __gproperties__ = {
+        "hscroll-policy": (Gtk.ScrollablePolicy, "hscroll-policy",
+                           "hscroll-policy", Gtk.ScrollablePolicy.MINIMUM,
+                           GObject.PARAM_READWRITE),
+        "hadjustment": (Gtk.Adjustment, "hadjustment", "hadjustment",
+                        GObject.PARAM_READWRITE),
+        "vscroll-policy": (Gtk.ScrollablePolicy, "hscroll-policy",
+                           "hscroll-policy", Gtk.ScrollablePolicy.MINIMUM,
+                           GObject.PARAM_READWRITE),
+        "vadjustment": (Gtk.Adjustment, "hadjustment", "hadjustment",
+                        GObject.PARAM_READWRITE),
+    }
+
+    image_activated = GObject.Signal('image_activated', arg_types=[int])
+
+    def __init__(self, rendition_cache=None):
+        Gtk.DrawingArea.__init__(self)
+
+        self._image_list = None
+        self._rendition_cache = rendition_cache
+        self._selected = None
+        self._scroll_pending = False
+
+        # Thumbnails by object id, None for images that could not be
+        # decoded, in least recently shown order.
+        self._thumbnails = collections.OrderedDict()
+        self._jobs = {}
+        self._wanted = set()
+
+        self._budget = memorybudget.get_memory_budget()
+        self._budget_key = ('thumbnails', id(self))
+
+        self._hadj = None
+        self._vadj = None
+
+        self.add_events(Gdk.EventMask.BUTTON_PRESS_MASK)
+        self.connect('draw', self.__draw_cb)
+        self.connect('size-allocate', self.__size_allocate_cb)
+        self.connect('button-press-event', self.__button_press_cb)
+
+    def set_image_list(self, image_list):
+        # The thumbnails are kept while the list stays the same.
+        if image_list is not self._image_list:
+            self.clear()
+        self._image_list = image_list
+        self.refresh()
+
+    def set_selected(self, index):
+        # Highlight the image and scroll to it.
+        self._selected = index
+        self._scroll_pending = True
+        self._scroll_to_selected()
+        self.queue_draw()
+
+    def _scroll_to_selected(self):
+        # Wait for the grid to be allocated to know where the image
+        # is.
+        if self._vadj is None or self.get_allocation().width <= 1:
+            return
+        self._scroll_pending = False
+
+        row_top = (self._selected // self._get_columns()) * CELL_SIZE
+        value = self._vadj.get_value()
+        page_size = self._vadj.get_page_size()
+        if row_top < value:
+            self._vadj.set_value(row_top)
+        elif row_top + CELL_SIZE > value + page_size:
+            self._vadj.set_value(row_top + CELL_SIZE - page_size)
+
+    def refresh(self):
+        # Called when the images changed, like when a page of them was
+        # loaded.
+        self._update_adjustments()
+        self.queue_draw()
+
+    def pause(self):
+        # Stop decoding while the grid is hidden.
+        for object_id in list(self._jobs.keys()):
+            self._cancel(object_id)
+        self._wanted = set()
+
+    def _cancel(self, object_id):
+        self._jobs.pop(object_id).cancel()
+        self._image_list.release_file_path(object_id)
+
+    def clear(self):
+        self.pause()
+        self._thumbnails.clear()
+        self._update_budget()
+
+    def _get_columns(self):
+        return max(1, self.get_allocation().width // CELL_SIZE)
+
+    def _get_offset(self):
+        # The cells are centered horizontally.
+        alloc = self.get_allocation()
+        return max(0, (alloc.width - self._get_columns() * CELL_SIZE) // 2)
+
+    def _update_budget(self):
+        size = 0
+        for surface in self._thumbnails.values():
+            if surface is not None:
+                size += memorybudget.get_surface_size(surface)
+        if size == 0:
+            self._budget.remove(self._budget_key)
+        else:
+            self._budget.add(self._budget_key, size, self.__evicted_cb)
+
+    def __evicted_cb(self, key):
+        # The visible thumbnails are loaded again on the next draw.
+        self._thumbnails.clear()
+        self.queue_draw()
+
+    def do_get_property(self, prop):
+        # We don't use the getter but GTK wants it defined as we are
+        # implementing Gtk.Scrollable interface.
+        pass
+
+    def do_set_property(self, prop, value):
+        # The scrolled window gives us the adjustments.  The grid only
+        # scrolls vertically.
+        if prop.name == 'hadjustment':
+            self._hadj = value
+        elif prop.name == 'vadjustment':
+            if value is not None:
+                value.connect('value-changed', self.__vadj_value_changed_cb)
+            self._vadj = value
+        self._update_adjustments()
+
+    def _update_adjustments(self):
+        alloc = self.get_allocation()
+        if self._hadj is not None:
+            self._hadj.configure(0, 0, alloc.width, 1, alloc.width,
+                                 alloc.width)
+
+        if self._vadj is not None:
+            count = 0
+            if self._image_list is not None:
+                count = len(self._image_list)
+            columns = self._get_columns()
+            height = max(alloc.height,
+                         (count + columns - 1) // columns * CELL_SIZE)
+            value = min(self._vadj.get_value(), height - alloc.height)
+            self._vadj.configure(max(0, value), 0, height, CELL_SIZE / 4,
+                                 alloc.height * 0.9, alloc.height)
+
+    def __size_allocate_cb(self, widget, alloc):
+        self._update_adjustments()
+        if self._scroll_pending:
+            self._scroll_to_selected()
+
+    def __vadj_value_changed_cb(self, adj):
+        self.queue_draw()
+
+    def _get_index_at(self, x, y):
+        column = (x - self._get_offset()) // CELL_SIZE
+        if column < 0 or column >= self._get_columns():
+            return None
+        row = (y + self._vadj.get_value()) // CELL_SIZE
+        index = int(row * self._get_columns() + column)
+        if index >= len(self._image_list):
+            return None
+        return index
+
+    def __button_press_cb(self, widget, event):
+        if self._image_list is None or self._vadj is None:
+            return False
+        index = self._get_index_at(event.x, event.y)
+        if index is None or self._image_list[index] is None:
+            return False
+        self.image_activated.emit(index)
+        return True
+
+    def _request_thumbnails(self, visible):
+        # Submitted in the order the cells are drawn, the thumbnail
+        # threads take them in that order.
+        wanted = set()
+        for index in visible:
+            jobject = self._image_list[index]
+            if jobject is None:
+                self._image_list.load_around(index)
+                continue
+
+            object_id = jobject.object_id
+            wanted.add(object_id)
+            if object_id in self._thumbnails:
+                self._thumbnails.move_to_end(object_id)
+                continue
+            if object_id in self._jobs:
+                continue
+
+            file_path = self._image_list.request_file_path(
+                object_id, self.__file_path_cb)
+            if file_path is not None:
+                self._submit(object_id, file_path)
+
+        for object_id in list(self._jobs.keys()):
+            if object_id not in wanted:
+                self._cancel(object_id)
+        self._wanted = wanted
+
+    def _submit(self, object_id, file_path):
+        # The file is released once the thumbnail is decoded.
+        self._jobs[object_id] = decoder.get_thumbnail_queue().submit(
+            decoder.PRIORITY_THUMBNAIL, ImageView.prepare_thumbnail,
+            functools.partial(self.__thumbnail_cb, object_id),
+            file_path, THUMBNAIL_SIZE, self._rendition_cache,
+            renditioncache.get_key(object_id, file_path))
+
+    def __file_path_cb(self, object_id, file_path):
+        # Images without a file can't have a thumbnail.
+        if file_path is None:
+            self._thumbnails[object_id] = None
+            self.queue_draw()
+        elif object_id in self._wanted and object_id not in self._jobs \
+                and object_id not in self._thumbnails:
+            self._submit(object_id, file_path)
+        else:
+            self._image_list.release_file_path(object_id)
+
+    def __thumbnail_cb(self, object_id, surface):
+        self._jobs.pop(object_id, None)
+        self._image_list.release_file_path(object_id)
+        self._thumbnails[object_id] = surface
+        while len(self._thumbnails) > MAX_THUMBNAILS:
+            self._thumbnails.popitem(last=False)
+        self._update_budget()
+        self.queue_draw()
+
+    def __draw_cb(self, widget, ctx):
+        if self._image_list is None or self._vadj is None:
+            return
+
+        alloc = self.get_allocation()
+        columns = self._get_columns()
+        offset = self._get_offset()
+        top = self._vadj.get_value()
+        first_row = int(top // CELL_SIZE)
+        last_row = int((top + alloc.height - 1) // CELL_SIZE)
+
+        visible = []
+        for row in range(first_row, last_row + 1):
+            for column in range(columns):
+                index = row * columns + column
+                if index >= len(self._image_list):
+                    break
+                visible.append(index)
+                self._draw_cell(ctx, index, offset + column * CELL_SIZE,
+                                row * CELL_SIZE - top)
+
+        self._request_thumbnails(visible)
+
+    def _draw_cell(self, ctx, index, x, y):
+        if index == self._selected:
+            ctx.rectangle(x + 2, y + 2, CELL_SIZE - 4, CELL_SIZE - 4)
+            ctx.set_source_rgba(0, 0, 0, 0.3)
+            ctx.fill()
+
+        jobject = self._image_list[index]
+        surface = None
+        if jobject is not None:
+            surface = self._thumbnails.get(jobject.object_id)
+
+        # Until the thumbnail is decoded, show a placeholder.
+        if surface is None:
+            ctx.rectangle(x + CELL_PADDING, y + CELL_PADDING,
+                          THUMBNAIL_SIZE, THUMBNAIL_SIZE)
+            ctx.set_source_rgba(0, 0, 0, 0.1)
+            ctx.fill()
+            return
+
+        width = surface.get_width()
+        height = surface.get_height()
+        ctx.set_source_surface(surface,
+                               x + (CELL_SIZE - width) // 2,
+                               y + (CELL_SIZE - height) // 2)
+        ctx.paint()